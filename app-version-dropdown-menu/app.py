@@ -1,41 +1,66 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
-from pymongo import MongoClient
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, Response
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo.errors import DuplicateKeyError
 from werkzeug.utils import secure_filename
+from werkzeug.local import LocalProxy
 import os
-import re
-import csv
+import sys
+import zipfile
 from urllib.parse import unquote
-from PyPDF2 import PdfReader
 import json
-import pandas as pd
-import plotly
-
-app = Flask(__name__)
+import logging
+import threading
+
+# Shared bill-processing modules live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pdf_text_cache
+import artifacts
+import bill_parser
+import mongo
+import bill_ingest
+import bill_jobs
+import bill_events
+import bill_exports
+import bill_schema
+import bill_stats
+import bill_summary
+import bill_series
+import forecast_service
+import uploads
+import metrics
+import app_log
+
+_app = Flask(__name__)  # Handed out as `app` only once create_app() has set it up
+logger = logging.getLogger(__name__)
+_configured = False
+_configure_lock = threading.Lock()
+
+# Uploaded files are spooled in memory and hashed while they are received
+_app.request_class = uploads.UploadRequest
 
 # Set the secret key for sessions
-app.secret_key = 'your_secret_key'
+_app.secret_key = 'your_secret_key'
 
-# MongoDB connection setup
-client = MongoClient('mongodb://localhost:27017/')  # Replace with your MongoDB URI
-db = client['Workshop2']  # Replace with your database name
-user_collection = db['user']  # User collection
-bill_collection = db['electric_bills']  # New collection for electric bills
-train_collection = db['electric_consumption']
+# MongoDB connection setup (see mongo.py for the URI and database name)
+# Proxies resolve on first use, so importing the app does not connect
+db = LocalProxy(mongo.get_db)
+user_collection = LocalProxy(lambda: mongo.get_db()['user'])  # User collection
+bill_collection = LocalProxy(lambda: mongo.get_db()['electric_bills'])  # New collection for electric bills
+train_collection = LocalProxy(lambda: mongo.get_db()['electric_consumption'])
 
 
 ### Function for Uploading electric Bills#######
 # Configure file upload folder
 UPLOAD_FOLDER = 'uploads'
 OUTPUT_FOLDER = os.path.join('static', 'output')  # Save in static for easy serving
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['OUTPUT_FOLDER'] = OUTPUT_FOLDER
+_app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+_app.config['OUTPUT_FOLDER'] = OUTPUT_FOLDER
 
-# Ensure the upload and output folders exist
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
-# Function to extract text from the PDF
-def extract_text_from_pdf(file_path):
+# Function to read every page of the PDF with PyPDF2
+def read_pdf_text(file_path):
+    from PyPDF2 import PdfReader
     reader = PdfReader(file_path)
     text = ""
     for page in reader.pages:
@@ -44,104 +69,30 @@ def extract_text_from_pdf(file_path):
 
 # Function to extract the Monthly Charges block
 def extract_monthly_charges_block(text):
-    start_marker = r"Caj Elektrik Anda Bagi Tempoh 6 Bulan"
-    end_marker = r"\d+\s?Purata Caj Bulanan"
-    pattern = f"{start_marker}.*?{end_marker}"
-
-    match = re.search(pattern, text, re.DOTALL)
-    if match:
-        return match.group()
+    section = bill_parser.section_text(text, "monthly_charges")
+    if section is not None:
+        return section
+    metrics.inc('bill_extraction_failures_total', reason='no_charges_section')
     return "No matching charges section found."
 
 # Function to extract month names and charges
 def extract_months_and_charges(charges_text):
-    months = []
-    charges = []
-    pattern = r"([A-Z]{3}-\d{2})(?:\s*\(BS\))?\s*([RM0-9,\.]+)|(?:\(BS\))?\s*([RM0-9,\.]+)\s*([A-Z]{3}-\d{2})"
-    matches = re.findall(pattern, charges_text)
-
-    for match in matches:
-        # Match groups for either case
-        if match[0]:  # Case where the month appears first
-            months.append(match[0])
-            charges.append(match[1])
-        else:  # Case where the charge appears first
-            charges.append(match[2])
-            months.append(match[3])
-
-
-    return months, charges
+    return bill_parser.parser.parse_monthly_charges(charges_text)
 
 # Function to extract the Detailed Charges block and save it to a .txt file
-def extract_detailed_charges_block(text, filename="detailed_charges_block.txt"):
-    start_marker = r"Keterangan Tanpa ST Dengan ST Jumlah"
-    end_marker = r"Caj Semasa RM \d+\.\d{2}"
-    pattern = f"{start_marker}.*?{end_marker}"
-
-    match = re.search(pattern, text, re.DOTALL)
-    if match:
-        detailed_charges_text = match.group()
-
-        # Save the extracted detailed charges block to a .txt file
-        with open(filename, "w") as file:
-            file.write(detailed_charges_text)
+def extract_detailed_charges_block(text, filename=None):
+    detailed_charges_text = bill_parser.section_text(text, "detailed_charges")
+    if detailed_charges_text is not None:
+        # Save the extracted detailed charges block to a .txt file when asked to
+        if filename:
+            artifacts.atomic_write_text(filename, detailed_charges_text)
 
         return detailed_charges_text
     else:
         return "No matching detailed charges section found."
 
 def extract_detailed_charges_data(detailed_charges_text):
-    total_usage_no_st = ""
-    total_usage_st = ""
-    icpt_no_st = ""
-    icpt_st = ""
-    kwtbb = ""
-    current_charge = ""
-
-    # Update regex to handle negative numbers with spaces
-    number_pattern = r"-?\s*[\d.,]+"  # Matches positive or negative numbers with optional spaces after '-'
-
-    # Extract Total Usage (No ST) and (ST)
-    total_usage_match = re.search(
-        fr"Jumlah Penggunaan Anda\s*\(.*?\)\s*RM\s*({number_pattern})\s*({number_pattern})\s*({number_pattern})",
-        detailed_charges_text,
-    )
-    if total_usage_match:
-        total_usage_no_st = total_usage_match.group(1).replace(" ", "")  # Remove extra spaces
-        total_usage_st = total_usage_match.group(2).replace(" ", "")
-
-    # Extract ICPT (No ST) and (ST)
-    icpt_match = re.search(
-        fr"ICPT\s*\(.*?\)\s*RM\s*({number_pattern})\s*({number_pattern})\s*({number_pattern})",
-        detailed_charges_text,
-    )
-    if icpt_match:
-        icpt_no_st = icpt_match.group(1).replace(" ", "")
-        icpt_st = icpt_match.group(2).replace(" ", "")
-
-    # Extract KWTBB
-    kwtbb_match = re.search(
-        fr"Kumpulan Wang Tenaga Boleh Baharu\s*\(.*?\)\s*RM\s*({number_pattern})",
-        detailed_charges_text,
-    )
-    if kwtbb_match:
-        kwtbb = kwtbb_match.group(1).replace(" ", "")
-
-    # Extract Current Charge
-    current_charge_match = re.search(
-        fr"Caj Semasa\s*RM\s*({number_pattern})", detailed_charges_text
-    )
-    if current_charge_match:
-        current_charge = current_charge_match.group(1).replace(" ", "")
-
-    return {
-        "Total Usage (No ST)": total_usage_no_st,
-        "Total Usage (ST)": total_usage_st,
-        "ICPT (No ST)": icpt_no_st,
-        "ICPT (ST)": icpt_st,
-        "KWTBB (1.6%)": kwtbb,
-        "Current Charge": current_charge,
-    }
+    return bill_parser.parser.parse_detailed_charges(detailed_charges_text)
 
 def parse_text_to_csv(txt_filename="detailed_charges_block.txt", csv_filename="detailed_charges_data.csv"):
     import csv  # Ensure the csv module is imported
@@ -178,109 +129,58 @@ def parse_text_to_csv(txt_filename="detailed_charges_block.txt", csv_filename="d
                 f"RM {extracted_data['Current Charge']}",
             ])
 
-        print(f"Data has been successfully written to {csv_filename} (headers as columns).")
+        logger.debug("Detailed charges written to %s", csv_filename)
 
     except FileNotFoundError:
-        print(f"Error: The file {txt_filename} does not exist.")
-    except Exception as e:
-        print(f"An error occurred: {e}")
+        logger.warning("The file %s does not exist", txt_filename)
+    except Exception:
+        logger.exception("Could not write %s", csv_filename)
 
 # Function to extract the meter reading block from the text
 def extract_meter_reading_block(text):
-    start_marker = r"Maklumat Meter"
-    end_marker = r"\s*PERBANKAN INTERNET"
-    
-    # Update the pattern to capture everything between the markers, including new lines and spaces
-    pattern = f"{start_marker}(.*?){end_marker}"
-    
-    # Perform the search to find the block between the markers
-    match = re.search(pattern, text, re.DOTALL)
-    
+    meter_reading_text = bill_parser.section_text(text, "meter_reading")
+
     # If no match is found, return a message indicating no matching block
-    if not match:
+    if meter_reading_text is None:
         return "no matching charges section found."
-    
-    # Extract the meter reading block
-    meter_reading_text = match.group(1).strip()
 
-    # Print the extracted meter reading text
-    print("###", meter_reading_text, "###")
+    logger.debug("Meter reading block found", extra={"chars": len(meter_reading_text)})
 
     # Return the isolated meter reading text
     return meter_reading_text
 
-# Function to save meter readings into CSV
-def save_meter_reading_to_csv(meter_reading_text, output_file_path):
-
-    meter_reading_text = re.sub(r"(kWh|kW|kVARh)Saluran", r"\1", meter_reading_text)
-
-    # Regular expression to capture the data fields in each row
-    pattern = r"(M\s+\S+)\s+(\d{1,3}(?:,\d{3})*)\s+(\d{1,3}(?:,\d{3})*)\s+(\d+)\s+(\w+)"
-    
-    # List to hold the parsed data
-    rows = []
-    
-    # Find all matches based on the pattern
-    for match in re.finditer(pattern, meter_reading_text):
-        meter_number = match.group(1).strip()
-        prev_reading = int(match.group(2).replace(",", ""))
-        curr_reading = int(match.group(3).replace(",", ""))
-        usage = int(match.group(4))
-        unit = match.group(5).strip()
-        
-        # Append the extracted data to rows
-        rows.append([meter_number, prev_reading, curr_reading, usage, unit])
-    
-    # Write the rows to a CSV file
-    with open(output_file_path, mode='w', newline='') as file:
-        writer = csv.writer(file)
-        # Writing the header
-        writer.writerow(["Meter Number", "Previous Meter Reading", "Current Meter Reading", "Usage", "Unit"])
-        # Writing the data rows
-        writer.writerows(rows)
-    
-    print(f"Data saved to {output_file_path}")
-
-def combine_csv_files(monthly_csv, detailed_csv, meter_reading_csv, output_csv):
-    try:
-        # Read the three CSV files into dataframes
-        monthly_df = pd.read_csv(monthly_csv)
-        detailed_df = pd.read_csv(detailed_csv)
-        meter_reading_df = pd.read_csv(meter_reading_csv)
-
-        # Merge the dataframes side by side (using pd.concat)
-        combined_df = pd.concat([monthly_df, detailed_df, meter_reading_df], axis=1)
-
-        # Save the combined dataframe to a new CSV file
-        combined_df.to_csv(output_csv, index=False)
-
-        print(f"Combined data saved to {output_csv}")
-        return output_csv  # Return the path to the combined CSV
-    except Exception as e:
-        print(f"Error during combining files: {e}")
-        return None
-
 
 
 #Train & Prediction Module 
-@app.route('/prediction', methods=['GET', 'POST'])
+@_app.route('/prediction', methods=['GET', 'POST'])
 def prediction():
     if request.method == 'POST':  # Check if the user clicked the Predict button
-        print("SUCeess")
+        if 'username' not in session:
+            return jsonify({"error": "Not logged in"}), 401
 
-        # Run Debug_.py (forecasting)
-        subprocess.run(["python", "Debug_.py"], check=True)
+        # Serve the cached forecast, or retrain in the background if new bills arrived
+        result = forecast_service.get_service(mongo.get_db).predict(session['username'])
+        result["status_url"] = url_for('prediction_status')
 
-        # Return a success message or redirect to a results page
-        return jsonify({"message": "Training and prediction completed successfully."})
+        # While training, the page polls the status endpoint for the result
+        return jsonify(result), 202 if result["status"] == "training" else 200
 
     # Render the prediction page for GET request
     return render_template('prediction_model.html')
 
 
+# Route to poll the current user's forecast (trains on first use)
+@_app.route('/prediction/status')
+def prediction_status():
+    if 'username' not in session:
+        return jsonify({"error": "Not logged in"}), 401
+
+    return jsonify(forecast_service.get_service(mongo.get_db).predict(session['username']))
+
 
 
-@app.route('/dashboard', methods=['GET', 'POST'])
+
+@_app.route('/dashboard', methods=['GET', 'POST'])
 def dashboard():
     if 'username' not in session:
         return redirect(url_for('log'))
@@ -296,12 +196,22 @@ def dashboard():
             return redirect(url_for('dashboard'))
 
         if file:
-            filename = secure_filename(file.filename)
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(file_path)
+            upload = uploads.receive(file)
+
+            # The same PDF was uploaded before: skip parsing and storing it again
+            # (unless an earlier attempt stored it without its summary/series updates)
+            existing = bill_ingest.find_duplicate(db, session['username'], upload.digest)
+            if existing is not None:
+                finished = bill_ingest.finish_incomplete(db, session['username'], existing)
+                if finished is None:
+                    flash('This bill has already been uploaded.', 'info')
+                    return redirect(url_for('dashboard'))
+                bill_events.publish(session['username'], finished["periods"])
+                flash('Electric bill data uploaded successfully!', 'success')
+                return redirect(url_for('dashboard'))
 
-            # Extract text from the PDF
-            pdf_text = extract_text_from_pdf(file_path)
+            # Extract text from the PDF straight from the upload buffer
+            pdf_text = pdf_text_cache.cached_extract(upload.open(), read_pdf_text, upload.digest)
 
             # Extract the Monthly Charges block
             extracted_text = extract_monthly_charges_block(pdf_text)
@@ -314,112 +224,92 @@ def dashboard():
                 electric_bill_data = {
                     "username": session['username'],
                     "months": months,
-                    "charges": charges
+                    "charges": charges,
+                    "content_hashes": [upload.digest],
+                    "derived_applied": False
                 }
-                db['electric_bills'].insert_one(electric_bill_data)
+                electric_bill_data.update(bill_schema.normalize_bill(electric_bill_data))
+                try:
+                    db['electric_bills'].insert_one(electric_bill_data)
+                except DuplicateKeyError:
+                    # The same file was submitted twice at once
+                    flash('This bill has already been uploaded.', 'info')
+                    return redirect(url_for('dashboard'))
+                bill_ingest.apply_derived(db, session['username'], [electric_bill_data])
+                bill_events.publish(session['username'], electric_bill_data["periods"])
                 flash('Electric bill data uploaded successfully!', 'success')
             else:
                 flash('Failed to extract monthly charges. Ensure the PDF is valid.', 'danger')
 
             return redirect(url_for('dashboard'))
 
-    # Retrieve user's electric bills from MongoDB
-    electric_bills = db['electric_bills'].find({"username": session['username']})
-
-    # Pre-zip months and charges for each bill
-    formatted_bills = []
-
-    for bill in electric_bills:
-        months = bill.get("months", [])
-        charges = bill.get("charges", [])
+    # Read the user's precomputed bill summary instead of scanning every bill
+    summary = bill_summary.get_summary(db, session['username'])
 
-        # Validate that months and charges are not empty
-        if months and charges:
-            formatted_bills.append({
-                "data": list(zip(months, charges))
-            })
+    # Deduplicated month/charge pairs across all of the user's bills
+    series = bill_series.series_pairs(db, session['username'])
+    formatted_bills = [{"data": series}] if series else []
 
     # Pass empty lists if no data found
-    months = months if months else []
-    charges = charges if charges else []
+    months = summary.get("latest_months", [])
+    charges = summary.get("latest_charges", [])
 
     return render_template('index-new.html', username=session['username'], electric_bills=formatted_bills, months=months, charges=charges)
 
 # Route for new login
-@app.route('/', methods=['GET', 'POST'])
+@_app.route('/', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         email = request.form.get('email')
         password = request.form.get('password')
 
-        print(f"Email: {email}, Password: {password}")
-
         # Authenticate user
-        user = user_collection.find_one({"email": email, "password": password})
+        user = user_collection.find_one({"email": email, "password": password}, {"username": 1})
         if user:
             session['email'] = email
             session['username'] = user.get('username', 'Guest')  # Default to 'Guest' if username is not found
-            print("Success")
+            logger.info("Login succeeded", extra={"email": email})
             return redirect(url_for('test'))
         else:
             flash("Invalid credentials.", "danger")
-            print("GAGAL")
+            logger.info("Login failed", extra={"email": email})
 
     return render_template('auth-boxed-login.html')
 
 
 # Route for new dashboard
-@app.route('/test', methods=['GET', 'POST'])
+@_app.route('/test', methods=['GET', 'POST'])
 def test():
     if 'email' not in session:
         return redirect(url_for('login'))
     
-    # Query the database for all bills of the current user
-    user_bills_data = db['electric_bills'].find({"username": session['username']})
-
-    # List to store the last months of each bill
-    last_months = []  # Initialize as an empty list
-    bill_data = []  # This will store all the bills
-    all_charges = []  # To calculate the average monthly charge
-
-    # Iterate through the user's bills
-    for bill in user_bills_data:
-        months = bill.get('Months', [])
-        charges = bill.get('Charges', [])
-
-        if months and charges:
-            last_month = months[-1]  # Get the last month from the 'Months' array
-            last_months.append(last_month)  # Add it to the list of last months
-            bill_data.append(bill)  # Save the bill data for later use
-            
-            # Add the charge to the all_charges list for calculating the average
-            all_charges.append(float(charges[-1].replace("RM", "").replace(",", "")))  # Convert charge to float
-
-    # Calculate the average monthly charge
-    avg_monthly_charge = sum(all_charges) / len(all_charges) if all_charges else 0
-
-    # Find the maximum charge
-    max_charge = max(all_charges) if all_charges else 0
+    # Read the precomputed last months, average and maximum charge
+    stats = bill_summary.summary_stats(bill_summary.get_summary(db, session['username']))
+    last_months = stats['last_months']
+    charges = stats['charges']
+    avg_monthly_charge = stats['avg_monthly_charge']
+    max_charge = stats['max_charge']
 
     # Handle form submission to select a specific bill based on last month index
     selected_bill = None
     selected_month = None
     selected_charge = None
     if request.method == 'POST':
-        selected_month_index = int(request.form['month_index'])  # Get the selected month index from the form
-        selected_bill = bill_data[selected_month_index]  # Select the corresponding bill data
-        
-        # Get the months and charges for the selected bill
-        months = selected_bill.get('Months', [])
-        charges = selected_bill.get('Charges', [])
-
-        # Calculate the average monthly charge for the selected bill
-        charges_float = [float(charge.replace("RM", "").replace(",", "")) for charge in charges]
-        selected_month = months[-1]  # The last month is the selected month
-        selected_charge = charges[-1]  # The charge for the selected month
-        
-        avg_monthly_charge = sum(charges_float) / len(charges_float) if charges_float else 0
-        max_charge = max(charges_float) if charges_float else 0
+        selected_month_index = request.form.get('month_index', type=int)  # Get the selected month index from the form
+        if selected_month_index is None or selected_month_index < 0:
+            # $skip rejects negative values, so they never reach the aggregation
+            flash('Invalid month selection.', 'danger')
+            selected = None
+        else:
+            selected = bill_stats.selected_bill_stats(db, session['username'], selected_month_index)
+
+        if selected:
+            selected_bill = selected['bill']
+            charges = selected_bill['Charges']
+            selected_month = selected['selected_month']  # The last month is the selected month
+            selected_charge = selected['selected_charge']  # The charge for the selected month
+            avg_monthly_charge = selected['avg_monthly_charge']
+            max_charge = selected['max_charge']
 
     # Pass the last months, selected bill, average charge, and max charge to the template
     return render_template('index-new.html', 
@@ -436,7 +326,7 @@ def test():
 
 
 #Electric Bills Module 
-@app.route('/electric', methods=['GET', 'POST'])
+@_app.route('/electric', methods=['GET', 'POST'])
 def electric():
     if request.method == 'POST':
         if 'file' not in request.files:
@@ -446,124 +336,118 @@ def electric():
         file = request.files['file']
         if file.filename == '':
             flash('No file selected', 'danger')
-            print("No file selected, danger")
             return redirect(url_for('electric'))
 
         if file:
+            upload = uploads.receive(file)
+
+            # Parse and store the bill on the ingestion pool instead of the request thread
+            # (the worker gets the stored path when uploads are persisted, else the bytes)
+            job_id = bill_jobs.submit_job(session['username'], bill_ingest.ingest_bill,
+                                          upload.source(), session['username'], False, upload.digest,
+                                          on_done=bill_events.on_ingest_done(session['username']))
+
+            if request.accept_mimetypes.best == 'application/json':
+                return jsonify({"job_id": job_id, "status_url": url_for('job_status', job_id=job_id)}), 202
+
+            flash(f'Electric bill uploaded. Processing as job {job_id}.', 'info')
+            return redirect(url_for('electric'))
+
+    # Deduplicated month/charge pairs from the user's monthly time series
+    series = bill_series.series_pairs(db, session['username'])
+    formatted_bills = [{"data": series}] if series else []
+
+    return render_template('electric_bills.html', username=session['username'], electric_bills=formatted_bills)
+
+
+
+# Route to download a CSV export of a stored bill (generated on demand)
+@_app.route('/electric/export/<bill_id>/<kind>.csv')
+def export_bill(bill_id, kind):
+    if 'username' not in session:
+        return redirect(url_for('login'))
+    if kind not in bill_exports.EXPORTS:
+        return "Unknown export", 404
+
+    try:
+        bill = db['electric_bills'].find_one({"_id": ObjectId(bill_id), "username": session['username']},
+                                             bill_exports.EXPORT_FIELDS)
+    except InvalidId:
+        bill = None
+    if bill is None:
+        return "Bill not found", 404
+
+    return Response(
+        bill_exports.render_export(bill, kind),
+        mimetype='text/csv',
+        headers={"Content-Disposition": f"attachment; filename={kind}.csv"}
+    )
+
+
+# Route to upload many bill PDFs (or ZIP archives of PDFs) in one request
+@_app.route('/electric/batch', methods=['POST'])
+def electric_batch():
+    if 'username' not in session:
+        return jsonify({"error": "Not logged in"}), 401
+
+    files = [file for file in request.files.getlist('files') if file.filename]
+    if not files:
+        return jsonify({"error": "No files selected"}), 400
+
+    pdfs = []
+    results = []
+    total_bytes = 0
+    try:
+        for file in files:
             filename = secure_filename(file.filename)
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(file_path)
-
-            # Extract text from the PDF
-            pdf_text = extract_text_from_pdf(file_path)
-
-            # **Monthly Charges Extraction**
-            monthly_charges_text = extract_monthly_charges_block(pdf_text)
-            months, charges = extract_months_and_charges(monthly_charges_text)
-
-            monthly_output_file_path = os.path.join(app.config['OUTPUT_FOLDER'], 'monthly_charges.csv')
-            with open(monthly_output_file_path, 'w', newline='') as csvfile:
-                writer = csv.writer(csvfile)
-                writer.writerow(['Month', 'Charge'])
-                for month, charge in zip(months, charges):
-                    writer.writerow([month, charge])
-
-            # **Detailed Charges Extraction**
-            detailed_charges_text = extract_detailed_charges_block(pdf_text)
-            extracted_detailed_charges_data = extract_detailed_charges_data(detailed_charges_text)
-
-            detailed_output_file_path = os.path.join(app.config['OUTPUT_FOLDER'], 'detailed_charges_data.csv')
-            with open(detailed_output_file_path, 'w', newline='') as csvfile:
-                writer = csv.writer(csvfile)
-                writer.writerow(extracted_detailed_charges_data.keys())
-                writer.writerow(extracted_detailed_charges_data.values())
-
-                # **Meter Reading Extraction**
-                meter_reading_text = extract_meter_reading_block(pdf_text)
-                meter_reading_output_file_path = os.path.join(app.config['OUTPUT_FOLDER'], 'meter_reading_data.csv')
-                save_meter_reading_to_csv(meter_reading_text, meter_reading_output_file_path)
-                # Step 1: Read the CSV file that contains the meter readings
-
-                meter_reading_df = pd.read_csv(meter_reading_output_file_path)
-                # Step 2: Check if the data in the CSV is correct
-                print(meter_reading_df.head())  # This will print the first few rows of the DataFrame
-
-                # Step 3: Extract the data into lists (ensure column names match exactly)
-                meter_numbers = meter_reading_df['Meter Number'].tolist()
-                previous_meter_reading = meter_reading_df['Previous Meter Reading'].tolist()
-                current_meter_reading = meter_reading_df['Current Meter Reading'].tolist()
-                usage = meter_reading_df['Usage'].tolist()
-                unit = meter_reading_df['Unit'].tolist()
-
-                # Step 4: Check for missing or NaN values and replace with defaults
-                meter_numbers = [x if pd.notna(x) else "N/A" for x in meter_numbers]
-                previous_meter_reading = [x if pd.notna(x) else 0 for x in previous_meter_reading]
-                current_meter_reading = [x if pd.notna(x) else 0 for x in current_meter_reading]
-                usage = [x if pd.notna(x) else 0 for x in usage]
-                unit = [x if pd.notna(x) else "kWh" for x in unit]  # Default to 'kWh' if missing
-
-            # **Combine the CSVs**
-            combined_output_file_path = os.path.join(app.config['OUTPUT_FOLDER'], 'combined_output.csv')
-            combine_csv_files(
-                monthly_csv=monthly_output_file_path,
-                detailed_csv=detailed_output_file_path,
-                meter_reading_csv=meter_reading_output_file_path,
-                output_csv=combined_output_file_path
-            )
-
-            # Save the months and charges to MongoDB
-            if months and charges and extracted_detailed_charges_data:
-            # Create a single document with all fields grouped into arrays
-                electric_bill_data = {
-                "username": session['username'],
-                "Months": months,
-                "Charges": charges,
-                "Total Usage (No ST)": extracted_detailed_charges_data.get('Total Usage (No ST)', []),
-                "Total Usage (ST)": extracted_detailed_charges_data.get('Total Usage (ST)', []),
-                "ICPT (No ST)": extracted_detailed_charges_data.get('ICPT (No ST)', []),
-                "ICPT (ST)": extracted_detailed_charges_data.get('ICPT (ST)', []),
-                "KWTBB (1.6%)": extracted_detailed_charges_data.get('KWTBB (1.6%)', []),
-                "Current Charge": extracted_detailed_charges_data.get('Current Charge', []),
-                "Meter Numbers": meter_numbers,
-                "Previous Meter Reading": previous_meter_reading,
-                "Current Meter Reading": current_meter_reading,
-                "Usage": usage,
-                "Unit": unit
-            }
-                db['electric_bills'].insert_one(electric_bill_data)
-                flash('Electric bill data uploaded and extracted successfully!', 'success')
-                print("Electric bill data uploaded and extracted successfully!, success")
+            if filename.lower().endswith('.zip'):
+                # ZIP members are counted against the batch limits while they are read
+                try:
+                    zip_pdfs, errors = bill_ingest.extract_pdfs_from_zip(file.stream, len(pdfs), total_bytes)
+                except zipfile.BadZipFile:
+                    results.append({"filename": filename, "status": "error", "error": "Invalid ZIP archive."})
+                    continue
+                pdfs.extend(zip_pdfs)
+                total_bytes += sum(len(data) for _, data in zip_pdfs)
+                results.extend(errors)
+            elif filename.lower().endswith('.pdf'):
+                upload = uploads.receive(file)
+                total_bytes += upload.size
+                bill_ingest.check_batch_limits(len(pdfs) + 1, total_bytes)
+                pdfs.append((filename, upload.source()))
             else:
-                flash('Failed to extract monthly charges. Ensure the PDF is valid.', 'danger')
-                print("Failed to extract monthly charges. Ensure the PDF is valid., danger")
+                results.append({"filename": filename, "status": "error", "error": "Only PDF and ZIP files are accepted."})
+    except bill_ingest.BatchTooLarge as e:
+        return jsonify({"error": str(e)}), 413
 
-            return redirect(url_for('electric'))
+    # Parse the PDFs across all cores and store them with a single insert_many
+    results.extend(bill_ingest.ingest_bill_batch(pdfs, session['username'], bill_jobs.get_executor()))
+    inserted = sum(1 for result in results if result["status"] == "ok")
+    duplicates = sum(1 for result in results if result["status"] == "duplicate")
 
-    # Retrieve user's electric bills from MongoDB
-    electric_bills = db['electric_bills'].find({"username": session['username']})
+    return jsonify({"inserted": inserted, "duplicates": duplicates,
+                    "failed": len(results) - inserted - duplicates, "files": results})
 
-    # Pre-zip months and charges for each bill
-    formatted_bills = []
-    for bill in electric_bills:
-        months = bill.get("Month", [])
-        charges = bill.get("Charge", [])
-        if months and charges:
-            formatted_bills.append({
-                "data": list(zip(months, charges))
-            })
 
-    return render_template('electric_bills.html', username=session['username'], electric_bills=formatted_bills)
+# Route to poll the status of a bill ingestion job
+@_app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = bill_jobs.get_job(job_id)
+    if job is None or job['username'] != session.get('username'):
+        return jsonify({"error": "Job not found"}), 404
+
+    return jsonify(job)
 
 
 
 #Suggestion Module
-@app.route('/suggestion', methods=['GET', 'POST'])
+@_app.route('/suggestion', methods=['GET', 'POST'])
 def suggestion():
     
     
     return render_template('suggestion.html')
 
-@app.route('/icon', methods=['GET', 'POST'])
+@_app.route('/icon', methods=['GET', 'POST'])
 def icon():
     
     
@@ -572,7 +456,7 @@ def icon():
 
 
 # Route for register
-@app.route('/register', methods=['GET', 'POST'])
+@_app.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
         username = request.form.get('username')
@@ -588,10 +472,10 @@ def register():
         household_size = request.form.get('household_size')
 
         # Check if username or email already exists
-        if user_collection.find_one({"username": username}):
+        if user_collection.find_one({"username": username}, {"_id": 1}):
             error = {"field": "username", "message": "Username already exists!"}
             return render_template('auth-boxed-register.html', error=error, form_data=request.form)
-        if user_collection.find_one({"email": email}):
+        if user_collection.find_one({"email": email}, {"_id": 1}):
             error = {"field": "email", "message": "Email already exists!"}
             return render_template('auth-boxed-register.html', error=error, form_data=request.form)
 
@@ -605,14 +489,14 @@ def register():
     return render_template('auth-boxed-register.html', error=None, form_data={})
 
 # Route for login
-@app.route('/log', methods=['GET', 'POST'])
+@_app.route('/log', methods=['GET', 'POST'])
 def log():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
 
         # Authenticate user
-        user = user_collection.find_one({"username": username, "password": password})
+        user = user_collection.find_one({"username": username, "password": password}, {"_id": 1})
         if user:
             session['username'] = username
             return redirect(url_for('dashboard'))
@@ -623,12 +507,61 @@ def log():
 
 
 
+# Route for the load balancer: Mongo latency and connection pool usage, 503 when unhealthy
+@_app.route('/healthz')
+def healthz():
+    report, healthy = mongo.health()
+    return jsonify(report), 200 if healthy else 503
+
+
 # Route for logout
-@app.route('/logout')
+@_app.route('/logout')
 def logout():
     session.pop('username', None)
     flash("Logged out successfully.", "info")
     return redirect(url_for('login'))
 
+# Function to finish setting up the app (startup side effects live here, not at import)
+# e.g. gunicorn "app:create_app()" (or app:app)
+# Safe to call more than once: the setup runs on the first call and every call returns the same app
+def create_app():
+    global _configured
+    with _configure_lock:
+        if not _configured:
+            _configure()
+            _configured = True
+    return _app
+
+
+def _configure():
+    # Ensure the output folder exists (uploads are only written when PERSIST_UPLOADS=1)
+    os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+
+    # Request timings and pipeline stage timings (including pool workers) at /metrics
+    metrics.init_app(_app)
+
+    # JSON logs written by a background thread, one record per request with its stage timings
+    # (pool workers log their own "Bill ingest" records)
+    app_log.init_app(_app)
+
+    # Stored uploads (PERSIST_UPLOADS=1) and output folders expire, and the PDF text cache is trimmed, in the background
+    artifacts.add_cleanup(uploads.cleanup_expired)
+    artifacts.add_cleanup(pdf_text_cache.evict_disk_cache)
+    artifacts.start_janitor()
+
+    # Keep forecasts current as bills arrive instead of waiting for the next full retrain
+    bill_events.subscribe(forecast_service.get_service(mongo.get_db).on_bill_ingested)
+
+    # Indexes are created on the first request rather than before the app can start
+    _app.before_request(mongo.ensure_indexes_once)
+
+
+# `app` (gunicorn app:app, flask run) is only handed out once create_app() has set it up
+def __getattr__(name):
+    if name == 'app':
+        return create_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app().run(debug=True)
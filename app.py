@@ -1,75 +1,105 @@
 from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
-from pymongo import MongoClient
-from werkzeug.utils import secure_filename
+from werkzeug.local import LocalProxy
 import os
-import re
 import csv
 from urllib.parse import unquote
-from PyPDF2 import PdfReader
 import json
-
-app = Flask(__name__)
+import logging
+import threading
+from pymongo.errors import DuplicateKeyError
+import pdf_text_cache
+import bill_ingest
+import bill_parser
+import bill_schema
+import bill_series
+import bill_summary
+import forecast_service
+import mongo
+import uploads
+import artifacts
+import metrics
+import app_log
+
+_app = Flask(__name__)  # Handed out as `app` only once create_app() has set it up
+logger = logging.getLogger(__name__)
+_configured = False
+_configure_lock = threading.Lock()
+
+# Uploaded files are spooled in memory and hashed while they are received
+_app.request_class = uploads.UploadRequest
 
 # Set the secret key for sessions
-app.secret_key = 'your_secret_key'
+_app.secret_key = 'your_secret_key'
 
-# MongoDB connection setup
-client = MongoClient('mongodb://localhost:27017/')  # Replace with your MongoDB URI
-db = client['Workshop2']  # Replace with your database name
-user_collection = db['user']  # User collection
-bill_collection = db['electric_bills']  # New collection for electric bills
-train_collection = db['electric_consumption']
+# MongoDB connection setup (see mongo.py for the URI and database name)
+# Proxies resolve on first use, so importing the app does not connect
+db = LocalProxy(mongo.get_db)
+user_collection = LocalProxy(lambda: mongo.get_db()['user'])  # User collection
+bill_collection = LocalProxy(lambda: mongo.get_db()['electric_bills'])  # New collection for electric bills
+train_collection = LocalProxy(lambda: mongo.get_db()['electric_consumption'])
 
 
 
 # Configure file upload folder
 UPLOAD_FOLDER = 'uploads'
 OUTPUT_FOLDER = os.path.join('static', 'output')  # Save in static for easy serving
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['OUTPUT_FOLDER'] = OUTPUT_FOLDER
+_app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+_app.config['OUTPUT_FOLDER'] = OUTPUT_FOLDER
 
-# Ensure the upload and output folders exist
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
 # Function to extract the desired block of text for Monthly Charges
+# Uses the shared bill_parser section (ends at "Purata Caj Bulanan", no trailing "&"),
+# which also reads bills that print the charge before the month
 def extract_monthly_charges_block(text):
-    start_marker = r"Caj Elektrik Anda Bagi Tempoh 6 Bulan"
-    end_marker = r"\d+\s?Purata Caj Bulanan &"  # Looks for a number followed by kWh
-    pattern = f"{start_marker}.*?{end_marker}"
-
-    match = re.search(pattern, text, re.DOTALL)
-    if match:
-        return match.group()
+    section = bill_parser.section_text(text, "monthly_charges")
+    if section is not None:
+        return section
+    metrics.inc('bill_extraction_failures_total', reason='no_charges_section')
     return "No matching charges section found."
 
 # Function to extract month names and charges
 def extract_months_and_charges(charges_text):
-    months = []
-    charges = []
-    pattern = r"([A-Z]{3}-\d{2})\s*(?:\(BS\))?\s*([RM0-9,\.]+)"
-    matches = re.findall(pattern, charges_text)
-
-    for match in matches:
-        month, charge = match
-        months.append(month)
-        charges.append(charge)
-
-    return months, charges
+    return bill_parser.parser.parse_monthly_charges(charges_text)
 
 # Function to extract the Detailed Charges block
 def extract_detailed_charges_block(text):
-    start_marker = r"Keterangan Tanpa ST Dengan ST Jumlah"
-    end_marker = r"Caj Semasa RM \d+\.\d{2}"
-    pattern = f"{start_marker}.*?{end_marker}"
-
-    match = re.search(pattern, text, re.DOTALL)
-    if match:
-        return match.group()
+    section = bill_parser.section_text(text, "detailed_charges")
+    if section is not None:
+        return section
     return "No matching detailed charges section found."
 
-# Function to extract text from the PDF
-def extract_text_from_pdf(file_path):
+# Function to answer an upload whose PDF is already stored, before it is parsed
+# Returns None for a new PDF, else the (message, category) to flash
+def stored_upload(username, digest):
+    existing = bill_ingest.find_duplicate(db, username, digest)
+    if existing is None:
+        return None
+    # Only an earlier attempt that stopped before the summary/series updates counts as new
+    if bill_ingest.finish_incomplete(db, username, existing) is None:
+        return 'This bill has already been uploaded.', 'info'
+    return 'Electric bill data uploaded successfully!', 'success'
+
+# Function to store a parsed bill and fold it into the user's summary and monthly series
+# Returns False when the same PDF was stored by a concurrent upload
+def store_bill(username, months, charges, digest):
+    electric_bill_data = {
+        "username": username,
+        "months": months,
+        "charges": charges,
+        "content_hashes": [digest],
+        "derived_applied": False
+    }
+    electric_bill_data.update(bill_schema.normalize_bill(electric_bill_data))
+    try:
+        db['electric_bills'].insert_one(electric_bill_data)
+    except DuplicateKeyError:
+        return False  # The same file was submitted twice at once
+    bill_ingest.apply_derived(db, username, [electric_bill_data])
+    return True
+
+# Function to read every page of the PDF with PyPDF2
+def read_pdf_text(file_path):
+    from PyPDF2 import PdfReader
     reader = PdfReader(file_path)
     text = ""
     for page in reader.pages:
@@ -77,24 +107,35 @@ def extract_text_from_pdf(file_path):
     return text
 
 #Train & Prediction Module 
-@app.route('/prediction', methods=['GET', 'POST'])
+@_app.route('/prediction', methods=['GET', 'POST'])
 def prediction():
     if request.method == 'POST':  # Check if the user clicked the Predict button
-        print("SUCeess")
+        if 'username' not in session:
+            return jsonify({"error": "Not logged in"}), 401
 
-        # Run Debug_.py (forecasting)
-        subprocess.run(["python", "Debug_.py"], check=True)
+        # Serve the cached forecast, or retrain in the background if new bills arrived
+        result = forecast_service.get_service(mongo.get_db).predict(session['username'])
+        result["status_url"] = url_for('prediction_status')
 
-        # Return a success message or redirect to a results page
-        return jsonify({"message": "Training and prediction completed successfully."})
+        # While training, the page polls the status endpoint for the result
+        return jsonify(result), 202 if result["status"] == "training" else 200
 
     # Render the prediction page for GET request
     return render_template('prediction_model.html')
 
 
+# Route to poll the current user's forecast (trains on first use)
+@_app.route('/prediction/status')
+def prediction_status():
+    if 'username' not in session:
+        return jsonify({"error": "Not logged in"}), 401
+
+    return jsonify(forecast_service.get_service(mongo.get_db).predict(session['username']))
+
+
 
 
-@app.route('/dashboard', methods=['GET', 'POST'])
+@_app.route('/dashboard', methods=['GET', 'POST'])
 def dashboard():
     if 'username' not in session:
         return redirect(url_for('log'))
@@ -110,12 +151,16 @@ def dashboard():
             return redirect(url_for('dashboard'))
 
         if file:
-            filename = secure_filename(file.filename)
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(file_path)
+            upload = uploads.receive(file)
 
-            # Extract text from the PDF
-            pdf_text = extract_text_from_pdf(file_path)
+            # The same PDF was uploaded before: skip parsing and storing it again
+            stored = stored_upload(session['username'], upload.digest)
+            if stored is not None:
+                flash(*stored)
+                return redirect(url_for('dashboard'))
+
+            # Extract text from the PDF straight from the upload buffer
+            pdf_text = pdf_text_cache.cached_extract(upload.open(), read_pdf_text, upload.digest)
 
             # Extract the Monthly Charges block
             extracted_text = extract_monthly_charges_block(pdf_text)
@@ -125,65 +170,51 @@ def dashboard():
 
             # Save the data into MongoDB
             if months and charges:
-                electric_bill_data = {
-                    "username": session['username'],
-                    "months": months,
-                    "charges": charges
-                }
-                db['electric_bills'].insert_one(electric_bill_data)
+                if not store_bill(session['username'], months, charges, upload.digest):
+                    flash('This bill has already been uploaded.', 'info')
+                    return redirect(url_for('dashboard'))
                 flash('Electric bill data uploaded successfully!', 'success')
             else:
                 flash('Failed to extract monthly charges. Ensure the PDF is valid.', 'danger')
 
             return redirect(url_for('dashboard'))
 
-    # Retrieve user's electric bills from MongoDB
-    electric_bills = db['electric_bills'].find({"username": session['username']})
-
-    # Pre-zip months and charges for each bill
-    formatted_bills = []
+    # Read the user's precomputed bill summary instead of scanning every bill
+    summary = bill_summary.get_summary(db, session['username'])
 
-    for bill in electric_bills:
-        months = bill.get("months", [])
-        charges = bill.get("charges", [])
-
-        # Validate that months and charges are not empty
-        if months and charges:
-            formatted_bills.append({
-                "data": list(zip(months, charges))
-            })
+    # Deduplicated month/charge pairs across all of the user's bills
+    series = bill_series.series_pairs(db, session['username'])
+    formatted_bills = [{"data": series}] if series else []
 
     # Pass empty lists if no data found
-    months = months if months else []
-    charges = charges if charges else []
+    months = summary.get("latest_months", [])
+    charges = summary.get("latest_charges", [])
 
     return render_template('index.html', username=session['username'], electric_bills=formatted_bills, months=months, charges=charges)
 
 # Route for new login
-@app.route('/', methods=['GET', 'POST'])
+@_app.route('/', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         email = request.form.get('email')
         password = request.form.get('password')
 
-        print(f"Email: {email}, Password: {password}")
-
         # Authenticate user
-        user = user_collection.find_one({"email": email, "password": password})
+        user = user_collection.find_one({"email": email, "password": password}, {"_id": 1})
         if user:
             session['email'] = email
-            print("Success")
+            logger.info("Login succeeded", extra={"email": email})
             return redirect(url_for('test'))
         else:
             flash("Invalid credentials.", "danger")
-            print("GAGAL")
+            logger.info("Login failed", extra={"email": email})
 
     return render_template('auth-boxed-login.html')
 
 
 # Route for new dashboard
 
-@app.route('/test', methods=['GET', 'POST'])
+@_app.route('/test', methods=['GET', 'POST'])
 def test():
     if 'email' not in session:
         return redirect(url_for('login'))
@@ -194,7 +225,7 @@ def test():
 
 #Electric Bills Module 
 
-@app.route('/electric', methods=['GET', 'POST'])
+@_app.route('/electric', methods=['GET', 'POST'])
 def electric():
     
     if request.method == 'POST':
@@ -205,16 +236,19 @@ def electric():
         file = request.files['file']
         if file.filename == '':
             flash('No file selected', 'danger')
-            print("No file selected, danger")
             return redirect(url_for('electric'))
 
         if file:
-            filename = secure_filename(file.filename)
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(file_path)
+            upload = uploads.receive(file)
+
+            # The same PDF was uploaded before: skip parsing and storing it again
+            stored = stored_upload(session['username'], upload.digest)
+            if stored is not None:
+                flash(*stored)
+                return redirect(url_for('electric'))
 
-            # Extract text from the PDF
-            pdf_text = extract_text_from_pdf(file_path)
+            # Extract text from the PDF straight from the upload buffer
+            pdf_text = pdf_text_cache.cached_extract(upload.open(), read_pdf_text, upload.digest)
 
             # Extract the Monthly Charges block
             extracted_text = extract_monthly_charges_block(pdf_text)
@@ -224,39 +258,28 @@ def electric():
 
             # Save the data into MongoDB
             if months and charges:
-                electric_bill_data = {
-                    "username": session['username'],
-                    "months": months,
-                    "charges": charges
-                }
-                db['electric_bills'].insert_one(electric_bill_data)
+                if not store_bill(session['username'], months, charges, upload.digest):
+                    flash('This bill has already been uploaded.', 'info')
+                    return redirect(url_for('electric'))
                 flash('Electric bill data uploaded successfully!', 'success')
-                print("Electric bill data uploaded successfully!, success")
+                logger.info("Electric bill stored", extra={"username": session['username'], "months": len(months)})
             else:
                 flash('Failed to extract monthly charges. Ensure the PDF is valid.', 'danger')
-                print("Failed to extract monthly charges. Ensure the PDF is valid., danger")
+                logger.warning("Failed to extract monthly charges", extra={"username": session['username'],
+                                                                        "digest": upload.digest})
 
             return redirect(url_for('electric'))
 
-    # Retrieve user's electric bills from MongoDB
-    electric_bills = db['electric_bills'].find({"username": session['username']})
+    # Read the user's precomputed bill summary instead of scanning every bill
+    summary = bill_summary.get_summary(db, session['username'])
 
-    # Pre-zip months and charges for each bill
-    formatted_bills = []
-
-    for bill in electric_bills:
-        months = bill.get("months", [])
-        charges = bill.get("charges", [])
-
-        # Validate that months and charges are not empty
-        if months and charges:
-            formatted_bills.append({
-                "data": list(zip(months, charges))
-            })
+    # Deduplicated month/charge pairs across all of the user's bills
+    series = bill_series.series_pairs(db, session['username'])
+    formatted_bills = [{"data": series}] if series else []
 
     # Pass empty lists if no data found
-    months = months if months else []
-    charges = charges if charges else []
+    months = summary.get("latest_months", [])
+    charges = summary.get("latest_charges", [])
 
     
     
@@ -265,13 +288,13 @@ def electric():
 
 #Suggestion Module
 
-@app.route('/suggestion', methods=['GET', 'POST'])
+@_app.route('/suggestion', methods=['GET', 'POST'])
 def suggestion():
     
     
     return render_template('suggestion.html')
 
-@app.route('/icon', methods=['GET', 'POST'])
+@_app.route('/icon', methods=['GET', 'POST'])
 def icon():
     
     
@@ -280,7 +303,7 @@ def icon():
 
 
 # Route for register
-@app.route('/register', methods=['GET', 'POST'])
+@_app.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
         username = request.form.get('username')
@@ -288,7 +311,7 @@ def register():
         email = request.form.get('email')
 
         # Check if user already exists
-        if user_collection.find_one({"username": username}):
+        if user_collection.find_one({"username": username}, {"_id": 1}):
             flash("Username already exists.", "danger")
             return redirect(request.url)
 
@@ -302,14 +325,14 @@ def register():
     return render_template('auth-boxed-register.html')
 
 # Route for login
-@app.route('/log', methods=['GET', 'POST'])
+@_app.route('/log', methods=['GET', 'POST'])
 def log():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
 
         # Authenticate user
-        user = user_collection.find_one({"username": username, "password": password})
+        user = user_collection.find_one({"username": username, "password": password}, {"_id": 1})
         if user:
             session['username'] = username
             return redirect(url_for('dashboard'))
@@ -320,7 +343,7 @@ def log():
 
 
 # Route for signup
-@app.route('/signup', methods=['GET', 'POST'])
+@_app.route('/signup', methods=['GET', 'POST'])
 def signup():
     if request.method == 'POST':
         username = request.form.get('username')
@@ -328,7 +351,7 @@ def signup():
         email = request.form.get('email')
 
         # Check if user already exists
-        if user_collection.find_one({"username": username}):
+        if user_collection.find_one({"username": username}, {"_id": 1}):
             flash("Username already exists.", "danger")
             return redirect(request.url)
 
@@ -341,12 +364,56 @@ def signup():
 
     return render_template('signup.html')
 
+# Route for the load balancer: Mongo latency and connection pool usage, 503 when unhealthy
+@_app.route('/healthz')
+def healthz():
+    report, healthy = mongo.health()
+    return jsonify(report), 200 if healthy else 503
+
+
 # Route for logout
-@app.route('/logout')
+@_app.route('/logout')
 def logout():
     session.pop('username', None)
     flash("Logged out successfully.", "info")
     return redirect(url_for('login'))
 
+# Function to finish setting up the app (startup side effects live here, not at import)
+# Safe to call more than once: the setup runs on the first call and every call returns the same app
+def create_app():
+    global _configured
+    with _configure_lock:
+        if not _configured:
+            _configure()
+            _configured = True
+    return _app
+
+
+def _configure():
+    # Ensure the output folder exists (uploads are only written when PERSIST_UPLOADS=1)
+    os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+
+    # Request timings and pipeline counters at /metrics
+    metrics.init_app(_app)
+
+    # JSON logs written by a background thread, one record per request with its stage timings
+    app_log.init_app(_app)
+
+    # Stored uploads expire and the PDF text cache is trimmed in the background
+    artifacts.add_cleanup(uploads.cleanup_expired)
+    artifacts.add_cleanup(pdf_text_cache.evict_disk_cache)
+    artifacts.start_janitor()
+
+    # Indexes are created on the first request rather than before the app can start
+    _app.before_request(mongo.ensure_indexes_once)
+
+
+# `app` (gunicorn app:app, flask run) is only handed out once create_app() has set it up
+def __getattr__(name):
+    if name == 'app':
+        return create_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app().run(debug=True)
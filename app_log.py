@@ -0,0 +1,165 @@
+import contextvars
+import copy
+import json
+import logging
+import multiprocessing.util
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+
+# Logging settings
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')  # "json" (one object per line) or "text"
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', '1.0'))  # Share of DEBUG/INFO records kept; warnings always are
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', '10000'))  # Records past this are dropped, never waited on
+TEXT_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+# Attributes every LogRecord has; anything else was passed with extra={...} and becomes a JSON field
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'taskName'}
+
+_handler = None
+_lock = threading.Lock()
+_stages = contextvars.ContextVar('log_stages', default=None)  # stage -> milliseconds for the current request
+
+
+class JsonFormatter(logging.Formatter):
+    # One JSON object per record: time, level, logger, message and any extra={...} fields
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "pid": record.process,
+        }
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRS:
+                entry[name] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    # Keeps a random share of DEBUG/INFO records so busy paths cannot flood the log pipeline
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or self.rate >= 1 or random.random() < self.rate
+
+
+class _QueueHandler(QueueHandler):
+    # Hands records to the listener thread; a full queue drops the record instead of blocking
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.pid = os.getpid()
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        # Resolve the message and traceback here (the arguments may change later); serializing
+        # and writing happen on the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        if self.dropped:
+            record.dropped_records, self.dropped = self.dropped, 0
+        return record
+
+
+# Function to route all logging through a queue written to stderr by a background thread
+# Safe to call more than once; a forked pool worker gets its own queue and listener
+def setup(stream=None):
+    global _handler
+    with _lock:
+        if _handler is not None and _handler.pid == os.getpid():
+            return
+
+        output = logging.StreamHandler(stream or sys.stderr)
+        output.setFormatter(JsonFormatter() if LOG_FORMAT == 'json' else logging.Formatter(TEXT_FORMAT))
+        log_queue = queue.Queue(LOG_QUEUE_SIZE)
+        listener = QueueListener(log_queue, output)
+        listener.start()
+        # Flushes the queue at interpreter exit, and when a pool worker exits
+        multiprocessing.util.Finalize(None, listener.stop, exitpriority=0)
+
+        handler = _QueueHandler(log_queue)
+        handler.addFilter(SamplingFilter(LOG_SAMPLE_RATE))
+        root = logging.getLogger()
+        if _handler is not None:
+            root.removeHandler(_handler)
+        root.addHandler(handler)
+        root.setLevel(LOG_LEVEL)
+        _handler = handler
+
+
+# Function to tell whether stage durations are being collected for the current request
+def collecting_stages():
+    return _stages.get() is not None
+
+
+# Function to add a pipeline stage's duration to the current request's log record
+def record_stage(name, seconds):
+    stages = _stages.get()
+    if stages is not None:
+        stages[name] = round(stages.get(name, 0) + seconds * 1000, 3)
+
+
+# Context manager to collect stage durations (ms) outside a request, e.g. in a pool worker
+@contextmanager
+def collect_stages():
+    stages = {}
+    token = _stages.set(stages)
+    try:
+        yield stages
+    finally:
+        _stages.reset(token)
+
+
+# Function to log one record per request with its status, duration and per-stage durations
+def init_app(app):
+    from flask import g, request
+
+    setup()
+    logger = logging.getLogger('request')
+
+    @app.before_request
+    def _start_request_log():
+        g.log_start = time.perf_counter()
+        g.log_token = _stages.set({})
+
+    @app.after_request
+    def _log_request(response):
+        start = g.pop('log_start', None)
+        if start is not None and logger.isEnabledFor(logging.INFO):
+            logger.info("%s %s %s", request.method, request.path, response.status_code, extra={
+                "endpoint": request.endpoint,
+                "status": response.status_code,
+                "duration_ms": round((time.perf_counter() - start) * 1000, 3),
+                "stages": _stages.get() or {},
+            })
+        return response
+
+    @app.teardown_request
+    def _end_request_log(error=None):
+        token = g.pop('log_token', None)
+        if token is not None:
+            _stages.reset(token)
@@ -0,0 +1,114 @@
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+# Per-upload output folders live under static/ so they can be served directly
+ARTIFACT_ROOT = os.path.join('static', 'output')
+ARTIFACT_TTL_SECONDS = 24 * 60 * 60  # Artifacts older than this are removed
+JANITOR_INTERVAL_SECONDS = 60 * 60
+
+_janitor_started = False
+_janitor_lock = threading.Lock()
+_extra_cleanups = []  # Other expiring stores cleaned by the same janitor (see add_cleanup)
+logger = logging.getLogger(__name__)
+
+
+# Function to turn a username into a folder name
+# A hash, so distinct names never share a folder and names like ".." cannot escape the root
+def owner_key(owner):
+    return hashlib.sha256((owner or 'anonymous').encode('utf-8')).hexdigest()[:32]
+
+
+# Function to get (and create) the artifact folder for one upload
+# The folder is content-addressed: same user + same PDF bytes -> same folder
+def artifact_dir(digest, owner='anonymous'):
+    path = os.path.join(ARTIFACT_ROOT, owner_key(owner), digest[:32])
+    os.makedirs(path, exist_ok=True)
+    # Refresh the folder's age so the janitor keeps artifacts that are in use
+    os.utime(path)
+    return path
+
+
+# Context manager to write a file atomically (readers never see partial content)
+@contextmanager
+def atomic_open(path, mode='w', **kwargs):
+    folder = os.path.dirname(path) or '.'
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=f'.{os.path.basename(path)}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode, **kwargs) as file:
+            yield file
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def atomic_write_text(path, text, encoding='utf-8'):
+    with atomic_open(path, 'w', encoding=encoding) as file:
+        file.write(text)
+
+
+# Function to remove upload folders that have not been touched within the TTL
+def cleanup_expired(ttl_seconds=ARTIFACT_TTL_SECONDS):
+    if not os.path.isdir(ARTIFACT_ROOT):
+        return 0
+
+    cutoff = time.time() - ttl_seconds
+    removed = 0
+    for owner in os.listdir(ARTIFACT_ROOT):
+        owner_path = os.path.join(ARTIFACT_ROOT, owner)
+        if not os.path.isdir(owner_path):
+            continue
+        for upload in os.listdir(owner_path):
+            upload_path = os.path.join(owner_path, upload)
+            try:
+                if os.path.getmtime(upload_path) < cutoff:
+                    shutil.rmtree(upload_path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+# Function to have the janitor also run cleanup() (no arguments) on every pass
+def add_cleanup(cleanup):
+    with _janitor_lock:
+        if cleanup not in _extra_cleanups:
+            _extra_cleanups.append(cleanup)
+
+
+def _janitor_loop(interval_seconds, ttl_seconds):
+    while True:
+        try:
+            cleanup_expired(ttl_seconds)
+        except OSError as e:
+            logger.warning("Artifact cleanup failed: %s", e)
+        with _janitor_lock:
+            cleanups = list(_extra_cleanups)
+        for cleanup in cleanups:
+            try:
+                cleanup()
+            except OSError as e:
+                logger.warning("Cleanup %s failed: %s", cleanup.__name__, e)
+        time.sleep(interval_seconds)
+
+
+# Function to start the background janitor once per process
+def start_janitor(interval_seconds=JANITOR_INTERVAL_SECONDS, ttl_seconds=ARTIFACT_TTL_SECONDS):
+    global _janitor_started
+    with _janitor_lock:
+        if _janitor_started:
+            return
+        _janitor_started = True
+
+    thread = threading.Thread(target=_janitor_loop, args=(interval_seconds, ttl_seconds), daemon=True)
+    thread.start()
@@ -0,0 +1,314 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import bill_exports
+import bill_parser
+import bill_schema
+import pdf_stream
+import pdf_text_cache
+import text_normalizer
+
+# Synthetic TNB bill corpus + per-stage benchmark for the extraction pipeline.
+#   python bench_bills.py                                   # generate in memory and benchmark
+#   python bench_bills.py --corpus-dir bench_corpus         # also keep the generated PDFs
+#   python bench_bills.py --save-baseline bench_baseline.json
+#   python bench_bills.py --baseline bench_baseline.json    # exit 1 on a regression
+# Exits non-zero when a stage is slower than the baseline by more than --tolerance or when
+# any generated bill is parsed differently from what was generated.
+
+# Layouts of the "Caj Elektrik Anda Bagi Tempoh 6 Bulan" table handled by the month/charge regex
+MONTH_LAYOUTS = ("month_first", "charge_first", "estimated")
+FILLER_LINE = "Terma dan syarat bekalan elektrik tertakluk kepada Akta Bekalan Elektrik 1990."
+
+
+# Function to format an amount the way TNB bills do ("-3.91", or "- 3.91" on broken spacing)
+def _amount(value, broken=False):
+    text = f"{value:.2f}"
+    if broken and value < 0:
+        text = "- " + text[1:]
+    return text
+
+
+# Function to build one synthetic bill: page texts plus the values a parser should find
+def synthetic_bill(rng, layout=None, broken_spacing=None, filler_pages=None):
+    layout = layout or rng.choice(MONTH_LAYOUTS)
+    broken = rng.random() < 0.5 if broken_spacing is None else broken_spacing
+    filler_pages = rng.randint(0, 4) if filler_pages is None else filler_pages
+
+    account = "".join(rng.choice("0123456789") for _ in range(12))
+    last = rng.randint(2021 * 12, 2025 * 12 + 11)
+    periods = [bill_schema.format_period(datetime(index // 12, index % 12 + 1, 1))
+               for index in range(last - 5, last + 1)]
+    charges = [f"RM{rng.uniform(40, 900):.2f}" for _ in periods]
+
+    monthly_lines = ["Caj Elektrik Anda Bagi Tempoh 6 Bulan"]
+    for period, charge in zip(periods, charges):
+        if layout == "month_first":
+            monthly_lines.append(f"{period} {charge}")
+        elif layout == "charge_first":
+            monthly_lines.append(f"{charge} {period}")
+        else:
+            monthly_lines.append(f"{period} (BS) {charge}" if rng.random() < 0.5 else f"{period} {charge}")
+    monthly_lines.append(f"6Purata Caj Bulanan RM{rng.uniform(40, 900):.2f}")
+
+    usage = round(rng.uniform(40, 700), 2)
+    icpt = round(rng.uniform(-20, 20), 2)
+    kwtbb = round(usage * 0.016, 2)
+    current = round(usage + icpt + kwtbb, 2)
+    if broken:
+        detailed_lines = [
+            "Keterangan Tanpa  ST",
+            "Dengan ST Jumlah",
+            f"Jumlah Penggunaan Anda (kWh)   RM{_amount(usage)} 0.00 {_amount(usage)}",
+            f"ICPT (sen/kWh) RM {_amount(icpt, True)}  0.00 {_amount(icpt, True)}",
+            f"Kumpulan Wang Tenaga Boleh Baharu (1.6%) RM  {_amount(kwtbb)}",
+            f"Caj SemasaRM {_amount(current)}",
+        ]
+    else:
+        detailed_lines = [
+            "Keterangan Tanpa ST Dengan ST Jumlah",
+            f"Jumlah Penggunaan Anda (kWh) RM {_amount(usage)} 0.00 {_amount(usage)}",
+            f"ICPT (sen/kWh) RM {_amount(icpt)} 0.00 {_amount(icpt)}",
+            f"Kumpulan Wang Tenaga Boleh Baharu (1.6%) RM {_amount(kwtbb)}",
+            f"Caj Semasa RM {_amount(current)}",
+        ]
+
+    meters = []
+    meter_lines = ["Maklumat Meter", "No. Meter Bacaan Dahulu Bacaan Semasa Kegunaan Unit"]
+    for _ in range(rng.randint(1, 3)):
+        previous = rng.randint(100, 90000)
+        used = rng.randint(50, 900)
+        row = {
+            "Meter Number": f"M {rng.randint(1000000, 9999999)}",
+            "Previous Meter Reading": previous,
+            "Current Meter Reading": previous + used,
+            "Usage": used,
+            "Unit": "kWh",
+        }
+        meters.append(row)
+        unit = "kWhSaluran Biasa" if rng.random() < 0.5 else "kWh"
+        meter_lines.append(f"{row['Meter Number']} {previous:,} {previous + used:,} {used} {unit}")
+    meter_lines.append("PERBANKAN INTERNET")
+
+    pages = [
+        ["TENAGA NASIONAL BERHAD", "Bil Elektrik Anda", f"No. Akaun: {account}", *monthly_lines],
+        ["Butiran Caj", *detailed_lines],
+        [*meter_lines, "Bayar di myTNB"],
+    ]
+    pages += [[FILLER_LINE] * 40 for _ in range(filler_pages)]
+
+    expected = {
+        "account_number": account,
+        "months": periods,
+        "charges": charges,
+        "detailed_charges": {
+            "Total Usage (No ST)": _amount(usage),
+            "Total Usage (ST)": "0.00",
+            "ICPT (No ST)": _amount(icpt),
+            "ICPT (ST)": "0.00",
+            "KWTBB (1.6%)": _amount(kwtbb),
+            "Current Charge": _amount(current),
+        },
+        "meter_readings": meters,
+    }
+    return {"pages": pages, "expected": expected, "layout": layout, "broken_spacing": broken}
+
+
+def _pdf_escape(line):
+    return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+# Function to write page texts as a minimal one-font PDF (no PDF library needed)
+def build_pdf(pages):
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for lines in pages:
+        stream = "BT /F1 10 Tf 14 TL 50 800 Td " + " T* ".join(f"({_pdf_escape(line)}) Tj" for line in lines) + " ET"
+        objects.append(f"<< /Length {len(stream.encode('latin-1'))} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += f"{number} 0 obj\n{body}\nendobj\n".encode('latin-1')
+    xref = len(output)
+    output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode('latin-1')
+    for offset in offsets:
+        output += f"{offset:010d} 00000 n \n".encode('latin-1')
+    output += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode('latin-1')
+    return bytes(output)
+
+
+# Function to generate the benchmark corpus (optionally saving the PDFs and expected values)
+def generate_corpus(count, seed=0, corpus_dir=None):
+    rng = random.Random(seed)
+    corpus = []
+    for index in range(count):
+        bill = synthetic_bill(rng, layout=MONTH_LAYOUTS[index % len(MONTH_LAYOUTS)])
+        bill["pdf"] = build_pdf(bill["pages"])
+        # Pages are concatenated as-is, the same way read_pdf_text does
+        bill["text"] = "".join(pdf_stream.iter_pdf_pages(pdf_stream.open_pdf(bill["pdf"])))
+        if corpus_dir:
+            os.makedirs(corpus_dir, exist_ok=True)
+            with open(os.path.join(corpus_dir, f"bill_{index:04d}.pdf"), 'wb') as file:
+                file.write(bill["pdf"])
+            with open(os.path.join(corpus_dir, f"bill_{index:04d}.json"), 'w') as file:
+                json.dump(bill["expected"], file, indent=2)
+        corpus.append(bill)
+    return corpus
+
+
+# Function to list the fields a parsed bill gets wrong
+def check_bill(bill):
+    expected = bill["expected"]
+    record = bill_parser.parse_bill(bill["text"])
+    detailed = bill_parser.parser.parse_detailed_charges(
+        bill_parser.section_text(text_normalizer.normalize_section(bill["text"], "detailed_charges"),
+                                 "detailed_charges"))
+    errors = [field for field in ("account_number", "months", "charges", "meter_readings")
+              if record[field] != expected[field]]
+    if detailed != expected["detailed_charges"]:
+        errors.append("detailed_charges")
+    return errors
+
+
+# Benchmarked stages: name -> function(bill, iteration)
+def _read_full(bill, _):
+    return [page for page in pdf_stream.iter_pdf_pages(pdf_stream.open_pdf(bill["pdf"]))]
+
+
+def _extract_bill(bill, iteration):
+    # A fresh digest per call, so every run is a cache miss
+    return pdf_stream.extract_bill(bill["pdf"], hashlib.sha256(f"{iteration}".encode() + bill["pdf"]).hexdigest())
+
+
+def _parse_text(bill, _):
+    return bill_parser.parse_bill(bill["text"])
+
+
+def _detailed_regex(bill, _):
+    section = bill_parser.section_text(text_normalizer.normalize_section(bill["text"], "detailed_charges"),
+                                       "detailed_charges")
+    return bill_parser.parser.parse_detailed_charges(section)
+
+
+def _detailed_tokenizer(bill, _):
+    section = bill_parser.section_text(" ".join(text_normalizer.tokenize(bill["text"])), "detailed_charges")
+    return bill_parser.parser.parse_detailed_charges(section)
+
+
+def _csv_exports(bill, _):
+    record = bill_parser.parse_bill(bill["text"])
+    document = bill_parser.bill_document(record)
+    return [bill_exports.render_export(document, kind) for kind in bill_exports.EXPORTS]
+
+
+STAGES = {
+    "pdf_read_full": _read_full,
+    "pdf_extract_bill": _extract_bill,
+    "parse_text": _parse_text,
+    "detailed_regex": _detailed_regex,
+    "detailed_tokenizer": _detailed_tokenizer,
+    "csv_exports": _csv_exports,
+}
+
+
+# Function to time one stage over the corpus: latency per bill, throughput and peak memory
+def run_stage(stage, corpus, repeat):
+    timings = []
+    iteration = 0
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for bill in corpus:
+            start = time.perf_counter()
+            stage(bill, iteration)
+            timings.append((time.perf_counter() - start) * 1000)
+            iteration += 1
+    elapsed = time.perf_counter() - started
+
+    # Memory is measured on a separate pass, tracemalloc would distort the timings
+    tracemalloc.start()
+    for bill in corpus:
+        stage(bill, iteration)
+        iteration += 1
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings.sort()
+    return {
+        "median_ms": round(statistics.median(timings), 4),
+        "p95_ms": round(timings[int(len(timings) * 0.95) - 1], 4),
+        "bills_per_s": round(len(timings) / elapsed, 1),
+        "peak_kib": round(peak / 1024, 1),
+    }
+
+
+def main(argv=None):
+    args = argparse.ArgumentParser(description="Benchmark the bill extraction pipeline on synthetic TNB bills")
+    args.add_argument("--count", type=int, default=30, help="Bills to generate")
+    args.add_argument("--seed", type=int, default=0)
+    args.add_argument("--repeat", type=int, default=5, help="Timed passes over the corpus per stage")
+    args.add_argument("--corpus-dir", help="Also write the generated PDFs and expected values here")
+    args.add_argument("--baseline", help="JSON results to compare against")
+    args.add_argument("--save-baseline", help="Write this run's results as a baseline")
+    args.add_argument("--tolerance", type=float, default=0.25, help="Allowed median slowdown (0.25 = 25%%)")
+    args.add_argument("--output", help="Also write the report to this file (e.g. bench_output.txt)")
+    options = args.parse_args(argv)
+
+    # Keep benchmark cache entries out of the real text cache
+    pdf_text_cache.CACHE_FOLDER = tempfile.mkdtemp(prefix="bench_cache_")
+
+    corpus = generate_corpus(options.count, options.seed, options.corpus_dir)
+    report = [f"{len(corpus)} synthetic bills, {sum(len(bill['pages']) for bill in corpus)} pages, "
+              f"{options.repeat} passes per stage"]
+
+    failed = False
+    wrong = [(index, errors) for index, bill in enumerate(corpus) for errors in [check_bill(bill)] if errors]
+    for index, errors in wrong:
+        report.append(f"FAIL bill {index} ({corpus[index]['layout']}, broken spacing "
+                      f"{corpus[index]['broken_spacing']}): {', '.join(errors)}")
+    failed = bool(wrong)
+
+    results = {name: run_stage(stage, corpus, options.repeat) for name, stage in STAGES.items()}
+    baseline = {}
+    if options.baseline:
+        with open(options.baseline) as file:
+            baseline = json.load(file)
+
+    report.append(f"{'stage':<20}{'median ms':>11}{'p95 ms':>10}{'bills/s':>10}{'peak KiB':>10}  vs baseline")
+    for name, result in results.items():
+        line = (f"{name:<20}{result['median_ms']:>11.3f}{result['p95_ms']:>10.3f}"
+                f"{result['bills_per_s']:>10.1f}{result['peak_kib']:>10.1f}")
+        if name in baseline:
+            change = result["median_ms"] / baseline[name]["median_ms"] - 1 if baseline[name]["median_ms"] else 0.0
+            regressed = change > options.tolerance
+            failed = failed or regressed
+            line += f"  {change:+.0%}{'  REGRESSION' if regressed else ''}"
+        report.append(line)
+
+    if options.save_baseline:
+        with open(options.save_baseline, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    print("\n".join(report))
+    if options.output:
+        with open(options.output, 'w') as file:
+            file.write("\n".join(report) + "\n")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,39 @@
+import logging
+import threading
+from datetime import datetime
+
+# In-process "bill ingested" event: ingestion publishes, listeners (e.g. the forecast service) react
+_listeners = []
+_lock = threading.Lock()
+logger = logging.getLogger(__name__)
+
+
+# Function to register listener(username, periods) for newly ingested bills
+def subscribe(listener):
+    with _lock:
+        if listener not in _listeners:
+            _listeners.append(listener)
+
+
+# Function to tell every listener that a user's bill months were stored
+# periods are the bill's months as datetimes; a failing listener never fails the ingestion
+def publish(username, periods):
+    periods = sorted({period for period in periods if period is not None})
+    if not periods:
+        return
+    with _lock:
+        listeners = list(_listeners)
+    for listener in listeners:
+        try:
+            listener(username, periods)
+        except Exception:
+            logger.exception("Bill event listener %r failed", listener, extra={"username": username})
+
+
+# Function to build a bill_jobs on_done callback that publishes an ingest_bill result
+# (ingest_bill runs in a pool worker, so the event is raised here in the web process)
+def on_ingest_done(username):
+    def publish_result(result):
+        if result.get("inserted"):
+            publish(username, [datetime.strptime(period, "%Y-%m") for period in result.get("periods", [])])
+    return publish_result
@@ -0,0 +1,101 @@
+import csv
+import io
+import os
+from itertools import zip_longest
+
+import artifacts
+import bill_parser
+import bill_schema
+import metrics
+
+# electric_bills array fields behind each meter reading CSV column
+METER_FIELDS = (
+    ("Meter Number", "Meter Numbers"),
+    ("Previous Meter Reading", "Previous Meter Reading"),
+    ("Current Meter Reading", "Current Meter Reading"),
+    ("Usage", "Usage"),
+    ("Unit", "Unit"),
+)
+
+
+def monthly_table(bill):
+    return ["Month", "Charge"], list(zip(bill.get("Months", []), bill.get("Charges", [])))
+
+
+# Detailed charges columns Mongo cannot project (a "." in a key is read as a path) -> typed field in sen
+UNPROJECTABLE_FIELDS = {legacy_field: typed_field for legacy_field, typed_field in bill_schema.DETAILED_AMOUNT_FIELDS
+                        if "." in legacy_field}
+
+
+# Function to read a detailed charges column, formatting the typed amount when the key was not fetched
+def detailed_value(bill, key):
+    if key in bill:
+        return bill[key]
+    sen = bill.get(UNPROJECTABLE_FIELDS.get(key))
+    return "" if sen is None else f"{sen / 100:.2f}"
+
+
+def detailed_table(bill):
+    return list(bill_parser.DETAILED_CHARGES_KEYS), [[detailed_value(bill, key) for key in bill_parser.DETAILED_CHARGES_KEYS]]
+
+
+def meter_reading_table(bill):
+    header = [column for column, _ in METER_FIELDS]
+    return header, list(zip(*[bill.get(field, []) for _, field in METER_FIELDS]))
+
+
+# Function to place the three tables side by side (same layout as pd.concat(axis=1))
+def combined_table(bill):
+    tables = [monthly_table(bill), detailed_table(bill), meter_reading_table(bill)]
+    header = [column for table_header, _ in tables for column in table_header]
+    blanks = [[""] * len(table_header) for table_header, _ in tables]
+
+    rows = []
+    for parts in zip_longest(*[table_rows for _, table_rows in tables]):
+        row = []
+        for part, blank in zip(parts, blanks):
+            row.extend(part if part is not None else blank)
+        rows.append(row)
+    return header, rows
+
+
+# electric_bills fields the exports read (used as a query projection)
+EXPORT_FIELDS = ["Months", "Charges",
+                 *[key for key in bill_parser.DETAILED_CHARGES_KEYS if key not in UNPROJECTABLE_FIELDS],
+                 *UNPROJECTABLE_FIELDS.values(), *[field for _, field in METER_FIELDS]]
+
+
+# Export name -> function building (header, rows) from an electric_bills document
+EXPORTS = {
+    "monthly_charges": monthly_table,
+    "detailed_charges_data": detailed_table,
+    "meter_reading_data": meter_reading_table,
+    "combined_output": combined_table,
+}
+
+
+# Function to write one export of a bill to an open text file
+def write_export(bill, kind, file):
+    header, rows = EXPORTS[kind](bill)
+    writer = csv.writer(file)
+    writer.writerow(header)
+    writer.writerows(rows)
+
+
+# Function to render one export as a CSV string (generated on demand)
+def render_export(bill, kind):
+    buffer = io.StringIO()
+    write_export(bill, kind, buffer)
+    return buffer.getvalue()
+
+
+# Function to write every export of a bill into a folder
+def write_exports(bill, output_folder):
+    paths = {}
+    with metrics.stage("csv_exports"):
+        for kind in EXPORTS:
+            path = os.path.join(output_folder, f"{kind}.csv")
+            with artifacts.atomic_open(path, 'w', newline='') as file:
+                write_export(bill, kind, file)
+            paths[kind] = path
+    return paths
@@ -0,0 +1,332 @@
+import logging
+import os
+import time
+import zipfile
+
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from werkzeug.utils import secure_filename
+
+import app_log
+import artifacts
+import bill_events
+import bill_exports
+import bill_parser
+import bill_series
+import bill_summary
+import metrics
+import pdf_stream
+import pdf_text_cache
+import mongo
+
+# Limits for batch uploads
+MAX_BATCH_FILES = 200
+MAX_ZIP_MEMBER_BYTES = 20 * 1024 * 1024
+MAX_BATCH_BYTES = 200 * 1024 * 1024  # PDF bytes per batch, across all files and archives
+
+logger = logging.getLogger(__name__)
+
+
+# Function to find the user's bill stored from the same PDF bytes, or None
+def find_duplicate(db, username, digest):
+    return db['electric_bills'].find_one({"username": username, "content_hashes": digest},
+                                         {"_id": 1, "derived_applied": 1})
+
+
+# Function to find the stored bill a parsed document clashes with (same PDF, or same account + period)
+def find_conflict(db, document):
+    clauses = [{"content_hashes": {"$in": document.get("content_hashes", [])}}]
+    if document.get("account_number") and document.get("billing_period"):
+        clauses.append({"account_number": document["account_number"], "billing_period": document["billing_period"]})
+    return db['electric_bills'].find_one({"username": document["username"], "$or": clauses},
+                                         {"_id": 1, "derived_applied": 1})
+
+
+# Function to claim stored bills for their summary/series updates, so two uploads never apply the same bill
+# Returns the documents this caller claimed; the others are done or being applied elsewhere
+def claim_derived(db, documents):
+    claimed = []
+    for document in documents:
+        if db['electric_bills'].find_one_and_update({"_id": document["_id"], "derived_applied": False},
+                                                    {"$set": {"derived_applied": "applying"}},
+                                                    projection={"_id": 1}) is not None:
+            claimed.append(document)
+    return claimed
+
+
+# Function to fold stored bills into the summary and series, then mark them done
+# Bills are inserted with derived_applied=False and claimed before the updates; the series upserts
+# are idempotent and run first, so a retry after a failure here only re-runs what may be missing
+# Returns the documents that were applied by this call
+def apply_derived(db, username, documents):
+    documents = claim_derived(db, documents)
+    if not documents:
+        return []
+    ids = [document["_id"] for document in documents]
+    try:
+        with metrics.stage("summary_update"):
+            bill_series.record_bills(db, username, documents)
+            bill_summary.record_bills(db, username, documents)
+    except Exception:
+        # Release the claim so the next upload of the same bill can finish it
+        db['electric_bills'].update_many({"_id": {"$in": ids}, "derived_applied": "applying"},
+                                         {"$set": {"derived_applied": False}})
+        raise
+    db['electric_bills'].update_many({"_id": {"$in": ids}}, {"$set": {"derived_applied": True}})
+    return documents
+
+
+# Function to finish a stored bill whose summary/series updates failed after the insert
+# Returns the bill when it was finished here, None when it was already complete (or claimed by another upload)
+def finish_incomplete(db, username, existing):
+    if existing.get("derived_applied") is not False:
+        return None  # Complete, being applied, or stored before the flag existed
+    document = db['electric_bills'].find_one({"_id": existing["_id"], "derived_applied": False})
+    if document is None or not apply_derived(db, username, [document]):
+        return None
+    return document
+
+
+# Function to merge a re-issued copy of a stored bill: remember its hash so the next upload short-circuits
+def merge_duplicate(db, bill_id, document):
+    if not document.get("content_hashes"):
+        return
+    try:
+        db['electric_bills'].update_one(
+            {"_id": bill_id}, {"$addToSet": {"content_hashes": {"$each": document["content_hashes"]}}})
+    except DuplicateKeyError:
+        pass  # The hash already belongs to another stored bill
+
+
+def _duplicate_result(bill_id):
+    metrics.inc('bills_ingested_total', result='duplicate')
+    return {"inserted": False, "duplicate": True, "bill_id": str(bill_id),
+            "message": "This bill has already been uploaded."}
+
+
+def _inserted_result(document):
+    metrics.inc('bills_ingested_total', result='inserted')
+    return {"inserted": True, "bill_id": str(document["_id"]),
+            "periods": [period.strftime("%Y-%m") for period in document.get("periods", []) if period],
+            "message": "Electric bill data uploaded and extracted successfully!"}
+
+
+# Function to answer an upload that matches a stored bill: a duplicate, unless the stored bill
+# was left incomplete by an earlier (failed) attempt, which is then finished and reported as inserted
+def _existing_result(db, username, existing):
+    finished = finish_incomplete(db, username, existing)
+    if finished is not None:
+        return _inserted_result(finished)
+    return _duplicate_result(existing["_id"])
+
+
+# Function to run the full bill pipeline for one uploaded PDF (a stored path or raw bytes)
+# Runs inside a pool worker, so it returns a plain dict instead of flashing
+def ingest_bill(source, username, write_exports=False, digest=None):
+    start = time.perf_counter()
+    with app_log.collect_stages() as stages:
+        result = _ingest_bill(source, username, write_exports, digest)
+    outcome = "inserted" if result["inserted"] else "duplicate" if result.get("duplicate") else "failed"
+    logger.info("Bill ingest %s", outcome, extra={
+        "username": username, "outcome": outcome, "stages": stages,
+        "duration_ms": round((time.perf_counter() - start) * 1000, 3),
+    })
+    return result
+
+
+def _ingest_bill(source, username, write_exports, digest):
+    db = mongo.get_db()
+    if digest is None:
+        digest = pdf_text_cache.hash_pdf(source)
+
+    # The same PDF was uploaded before: skip parsing altogether
+    with metrics.stage("dedup_lookup"):
+        existing = find_duplicate(db, username, digest)
+    if existing is not None:
+        return _existing_result(db, username, existing)
+
+    # Read PDF pages until every bill section is found, then parse them in one pass
+    bill = pdf_stream.extract_bill(source, digest)
+    logger.debug("Read bill PDF", extra={"pages_read": bill["pages_read"], "pages_skipped": bill["pages_skipped"]})
+
+    if not (bill["months"] and bill["charges"]):
+        metrics.inc('bill_extraction_failures_total', reason='no_charges_section')
+        metrics.inc('bills_ingested_total', result='failed')
+        return {"inserted": False, "message": "Failed to extract monthly charges. Ensure the PDF is valid."}
+
+    # The parsed record goes straight to MongoDB, no CSV round-trip
+    electric_bill_data = bill_parser.bill_document(bill, username)
+    electric_bill_data["derived_applied"] = False
+
+    # A different file of the same bill (same account and billing period) is merged, not inserted
+    with metrics.stage("mongo_insert"):
+        existing = find_conflict(db, electric_bill_data)
+        if existing is None:
+            try:
+                db['electric_bills'].insert_one(electric_bill_data)
+            except DuplicateKeyError:
+                # Lost a race with a concurrent upload of the same bill
+                existing = find_conflict(db, electric_bill_data)
+                if existing is None:
+                    raise
+    if existing is not None:
+        merge_duplicate(db, existing["_id"], electric_bill_data)
+        return _existing_result(db, username, existing)
+
+    apply_derived(db, username, [electric_bill_data])
+
+    # CSV exports are optional; by default they are generated on demand from the stored bill
+    if write_exports:
+        bill_exports.write_exports(electric_bill_data, artifacts.artifact_dir(bill["digest"], username))
+
+    return _inserted_result(electric_bill_data)
+
+
+# Function to parse one PDF of a batch (runs in a pool worker, no file output)
+def parse_bill_file(filename, source, username, digest=None):
+    try:
+        bill = pdf_stream.extract_bill(source, digest)
+    except Exception as e:
+        metrics.inc('bill_extraction_failures_total', reason='unreadable_pdf')
+        return {"filename": filename, "status": "error", "error": f"Could not read PDF: {e}"}
+
+    if not (bill["months"] and bill["charges"]):
+        metrics.inc('bill_extraction_failures_total', reason='no_charges_section')
+        return {"filename": filename, "status": "error", "error": "No matching charges section found."}
+
+    return {"filename": filename, "status": "ok", "document": bill_parser.bill_document(bill, username)}
+
+
+class BatchTooLarge(ValueError):
+    # A batch upload went over MAX_BATCH_FILES or MAX_BATCH_BYTES
+    pass
+
+
+# Function to raise BatchTooLarge once a batch holds more PDFs or bytes than allowed
+def check_batch_limits(file_count, total_bytes):
+    if file_count > MAX_BATCH_FILES:
+        raise BatchTooLarge(f"At most {MAX_BATCH_FILES} PDFs per batch")
+    if total_bytes > MAX_BATCH_BYTES:
+        raise BatchTooLarge(f"At most {MAX_BATCH_BYTES // (1024 * 1024)} MB of PDFs per batch")
+
+
+# Function to read the PDFs of a ZIP upload into memory as (filename, bytes)
+# file_count / total_bytes are what the batch already holds; the limits are checked per member,
+# so an oversized archive is rejected as soon as it goes over them
+def extract_pdfs_from_zip(zip_file, file_count=0, total_bytes=0):
+    pdfs = []
+    errors = []
+    with zipfile.ZipFile(zip_file) as archive:
+        for member in archive.infolist():
+            name = os.path.basename(member.filename)
+            if member.is_dir() or not name.lower().endswith('.pdf'):
+                continue
+            check_batch_limits(file_count + len(pdfs) + 1, total_bytes)
+
+            # Read at most one byte past the limits so a lying header cannot blow up memory
+            with archive.open(member) as source:
+                data = source.read(min(MAX_ZIP_MEMBER_BYTES, MAX_BATCH_BYTES - total_bytes) + 1)
+            if len(data) > MAX_ZIP_MEMBER_BYTES:
+                errors.append({"filename": name, "status": "error", "error": "File is too large."})
+                continue
+            check_batch_limits(file_count + len(pdfs) + 1, total_bytes + len(data))
+
+            total_bytes += len(data)
+            pdfs.append((secure_filename(name), data))
+    return pdfs, errors
+
+
+# Function to parse many (filename, source) PDFs in parallel and store them with one insert_many
+# PDFs already stored (or repeated within the batch) are reported as duplicates without parsing
+def ingest_bill_batch(files, username, executor):
+    db = mongo.get_db()
+    digests = [pdf_text_cache.hash_pdf(source) for _, source in files]
+    stored = {}
+    for bill in db['electric_bills'].find({"username": username, "content_hashes": {"$in": digests}},
+                                          {"content_hashes": 1, "derived_applied": 1}):
+        for digest in bill["content_hashes"]:
+            stored[digest] = bill
+
+    results = []
+    to_parse = []
+    completed = []  # Stored bills an earlier failed upload left without summary/series updates
+    seen = set()
+    for (filename, source), digest in zip(files, digests):
+        if digest in stored:
+            existing = stored[digest]
+            finished = finish_incomplete(db, username, existing)
+            if finished is not None:
+                existing["derived_applied"] = True
+                completed.append(finished)
+                results.append({"filename": filename, "status": "ok", "bill_id": str(existing["_id"])})
+            else:
+                results.append({"filename": filename, "status": "duplicate", "bill_id": str(existing["_id"])})
+        elif digest in seen:
+            results.append({"filename": filename, "status": "duplicate", "error": "Repeated in this batch."})
+        else:
+            seen.add(digest)
+            to_parse.append((filename, source, digest))
+    metrics.inc('bills_ingested_total', len(completed), result='inserted')
+    metrics.inc('bills_ingested_total', len(results) - len(completed), result='duplicate')
+
+    # Workers send back the metrics they recorded along with each result
+    parsed = []
+    for result, worker_metrics in executor.map(
+        metrics.run_collecting,
+        [parse_bill_file] * len(to_parse),
+        [filename for filename, _, _ in to_parse],
+        [source for _, source, _ in to_parse],
+        [username] * len(to_parse),
+        [digest for _, _, digest in to_parse],
+    ):
+        metrics.merge(worker_metrics)
+        parsed.append(result)
+    results.extend(parsed)
+    metrics.inc('bills_ingested_total', sum(1 for result in parsed if result["status"] == "error"), result='failed')
+
+    pending = [(result, result.pop("document")) for result in parsed if result["status"] == "ok"]
+
+    # The unique indexes reject bills already stored under the same account and period
+    documents = [document for _, document in pending]
+    for document in documents:
+        document["derived_applied"] = False
+    rejected = set()
+    try:
+        if documents:
+            with metrics.stage("mongo_insert"):
+                db['electric_bills'].insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if e.details.get("writeConcernErrors") or any(
+                error["code"] != bill_series.DUPLICATE_KEY_ERROR for error in errors):
+            raise
+        rejected = {error["index"] for error in errors}
+
+    inserted = [document for index, (_, document) in enumerate(pending) if index not in rejected]
+    inserted_ids = {document["_id"] for document in inserted}
+    conflicts_finished = 0
+    for index, (result, document) in enumerate(pending):
+        if index not in rejected:
+            result["bill_id"] = str(document["_id"])
+            continue
+        existing = find_conflict(db, document)
+        result["status"] = "duplicate"
+        if existing is not None:
+            merge_duplicate(db, existing["_id"], document)
+            result["bill_id"] = str(existing["_id"])
+            if existing["_id"] in inserted_ids:
+                continue  # Another file of this batch is the same bill; it is applied below
+            finished = finish_incomplete(db, username, existing)
+            if finished is not None:
+                completed.append(finished)
+                conflicts_finished += 1
+                result["status"] = "ok"
+
+    metrics.inc('bills_ingested_total', len(inserted) + conflicts_finished, result='inserted')
+    metrics.inc('bills_ingested_total', len(documents) - len(inserted) - conflicts_finished, result='duplicate')
+    if inserted:
+        apply_derived(db, username, inserted)
+    if inserted or completed:
+        # Batches are stored from the web process, so listeners can be told directly
+        bill_events.publish(username, [period for document in inserted + completed for period in document["periods"]])
+
+    return results
@@ -0,0 +1,121 @@
+import logging
+import os
+import threading
+import uuid
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import app_log
+import metrics
+import mongo
+
+# Job queue settings
+MAX_WORKERS = os.cpu_count() or 2
+MAX_RETRIES = 2  # Extra attempts after the first failure
+COMPLETION_WORKERS = 4  # Threads recording results, so a slow Mongo never holds up the pool
+
+# Job status lives in Mongo so any web worker can answer a status poll; the process that
+# accepted the upload runs the job. Old jobs expire through a TTL index (see mongo.INDEXES).
+JOBS_COLLECTION = 'ingest_jobs'
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_lock = threading.Lock()
+
+# Done-callbacks run on the process pool's single management thread; the Mongo writes, on_done
+# and retries happen here instead (threads are only started on first use)
+_completions = ThreadPoolExecutor(max_workers=COMPLETION_WORKERS, thread_name_prefix="job-finish")
+
+
+# Function to get the shared process pool, recreating it if a worker died
+# Each worker logs through its own queue, like the web process
+def get_executor(reset=False):
+    global _executor
+    with _lock:
+        if _executor is None or reset:
+            _executor = ProcessPoolExecutor(max_workers=MAX_WORKERS, initializer=app_log.setup)
+        return _executor
+
+
+# Function to queue func(*args) and return its job ID straight away
+# on_done(result) is called in this process after a successful run
+def submit_job(username, func, *args, on_done=None):
+    job_id = uuid.uuid4().hex
+    mongo.get_db()[JOBS_COLLECTION].insert_one({
+        "_id": job_id,
+        "username": username,
+        "status": "queued",
+        "attempts": 0,
+        "result": None,
+        "error": None,
+        "created_at": datetime.utcnow(),
+        "finished_at": None,
+    })
+    _run(job_id, func, args, on_done, 1)
+    return job_id
+
+
+def _run(job_id, func, args, on_done, attempt):
+    _record(job_id, {"status": "running", "attempts": attempt})
+
+    # Workers send back the metrics they recorded along with the result
+    try:
+        future = get_executor().submit(metrics.run_collecting, func, *args)
+    except BrokenProcessPool:
+        future = get_executor(reset=True).submit(metrics.run_collecting, func, *args)
+    future.add_done_callback(lambda done: _completions.submit(_complete, job_id, func, args, on_done, attempt, done))
+
+
+# Function to run _finish on a completion thread, where nothing else would report its errors
+def _complete(job_id, func, args, on_done, attempt, future):
+    try:
+        _finish(job_id, func, args, on_done, attempt, future)
+    except Exception:
+        logger.exception("Could not finish job", extra={"job_id": job_id})
+
+
+# Function to record a job result, retrying failed attempts
+def _finish(job_id, func, args, on_done, attempt, future):
+    error = future.exception()
+    if error is None:
+        result, worker_metrics = future.result()
+        metrics.merge(worker_metrics)
+        metrics.inc('jobs_total', status='done')
+        _record(job_id, {"status": "done", "result": result, "error": None, "finished_at": datetime.utcnow()})
+        if on_done is not None:
+            try:
+                on_done(result)
+            except Exception:
+                logger.exception("Job callback failed", extra={"job_id": job_id})
+        return
+
+    if attempt > MAX_RETRIES:
+        metrics.inc('jobs_total', status='failed')
+        logger.error("Job failed", extra={"job_id": job_id, "attempts": attempt, "error": repr(error)})
+        _record(job_id, {"status": "failed", "error": repr(error), "finished_at": datetime.utcnow()})
+        return
+
+    metrics.inc('jobs_total', status='retried')
+    logger.warning("Job failed, retrying", extra={"job_id": job_id, "error": repr(error)})
+    _record(job_id, {"status": "retrying", "error": repr(error)})
+    _run(job_id, func, args, on_done, attempt + 1)
+
+
+# Function to update a job's status; retries run on a completion thread, so a failed
+# write is logged rather than raised
+def _record(job_id, fields):
+    try:
+        mongo.get_db()[JOBS_COLLECTION].update_one({"_id": job_id}, {"$set": fields})
+    except Exception:
+        logger.exception("Could not record job status", extra={"job_id": job_id})
+
+
+# Function to get a job's status, or None if it is unknown (or expired)
+def get_job(job_id):
+    job = mongo.get_db()[JOBS_COLLECTION].find_one({"_id": job_id})
+    if job is None:
+        return None
+    job["id"] = job.pop("_id")
+    return job
@@ -0,0 +1,243 @@
+import re
+
+import bill_schema
+
+# Bill sections as (name, start marker, end marker, keep markers in the section text)
+SECTIONS = (
+    ("monthly_charges", r"Caj Elektrik Anda Bagi Tempoh 6 Bulan", r"\d+\s?Purata Caj Bulanan", True),
+    ("detailed_charges", r"Keterangan Tanpa ST Dengan ST Jumlah", r"Caj Semasa RM \d+\.\d{2}", True),
+    ("meter_reading", r"Maklumat Meter", r"\s*PERBANKAN INTERNET", False),
+)
+
+# One alternation over every start/end marker so the text is scanned once
+SECTION_MARKERS_RE = re.compile("|".join(
+    f"(?P<{name}__start>{start})|(?P<{name}__end>{end})"
+    for name, start, end, _ in SECTIONS
+))
+
+# Whitespace-tolerant markers, for finding a section in raw PDF text before it is normalized
+LOOSE_SECTION_RES = {
+    name: (re.compile(start.replace(" ", r"\s*")), re.compile(end.replace(" ", r"\s*")))
+    for name, start, end, _ in SECTIONS
+}
+
+MONTH_CHARGE_RE = re.compile(
+    r"([A-Z]{3}-\d{2})(?:\s*\(BS\))?\s*([RM0-9,\.]+)|(?:\(BS\))?\s*([RM0-9,\.]+)\s*([A-Z]{3}-\d{2})"
+)
+
+# Matches positive or negative numbers with optional spaces after '-'
+NUMBER_PATTERN = r"-?\s*[\d.,]+"
+
+TOTAL_USAGE_RE = re.compile(
+    fr"Jumlah Penggunaan Anda\s*\(.*?\)\s*RM\s*({NUMBER_PATTERN})\s*({NUMBER_PATTERN})\s*({NUMBER_PATTERN})"
+)
+ICPT_RE = re.compile(
+    fr"ICPT\s*\(.*?\)\s*RM\s*({NUMBER_PATTERN})\s*({NUMBER_PATTERN})\s*({NUMBER_PATTERN})"
+)
+KWTBB_RE = re.compile(fr"Kumpulan Wang Tenaga Boleh Baharu\s*\(.*?\)\s*RM\s*({NUMBER_PATTERN})")
+CURRENT_CHARGE_RE = re.compile(fr"Caj Semasa\s*RM\s*({NUMBER_PATTERN})")
+
+# TNB account number, e.g. "No. Akaun: 220012345678"
+ACCOUNT_RE = re.compile(r"No\.?\s*Akaun\s*:?\s*(\d[\d ]{8,16}\d)")
+
+GLUED_UNIT_RE = re.compile(r"(kWh|kW|kVARh)Saluran")
+METER_ROW_RE = re.compile(r"(M\s+\S+)\s+(\d{1,3}(?:,\d{3})*)\s+(\d{1,3}(?:,\d{3})*)\s+(\d+)\s+(\w+)")
+
+DETAILED_CHARGES_KEYS = (
+    "Total Usage (No ST)",
+    "Total Usage (ST)",
+    "ICPT (No ST)",
+    "ICPT (ST)",
+    "KWTBB (1.6%)",
+    "Current Charge",
+)
+METER_READING_KEYS = ("Meter Number", "Previous Meter Reading", "Current Meter Reading", "Usage", "Unit")
+
+
+class BillParser:
+
+    # Function to advance the section state over text[pos:]
+    # state maps a section name to [start match, end match]
+    def scan(self, text, state, pos=0):
+        for match in SECTION_MARKERS_RE.finditer(text, pos):
+            name, kind = match.lastgroup.split("__")
+            found = state.setdefault(name, [None, None])
+            if kind == "start":
+                if found[0] is None:
+                    found[0] = match
+            elif found[0] is not None and found[1] is None and match.start() >= found[0].end():
+                found[1] = match
+        return state
+
+    # Function to cut every closed section out of the text
+    def section_texts(self, text, state):
+        sections = {}
+        for name, _, _, keep_markers in SECTIONS:
+            start, end = state.get(name, (None, None))
+            if start is None or end is None:
+                sections[name] = None
+            elif keep_markers:
+                sections[name] = text[start.start():end.end()]
+            else:
+                sections[name] = text[start.end():end.start()].strip()
+        return sections
+
+    # Function to locate all sections with a single scan of the text
+    def find_sections(self, text):
+        return self.section_texts(text, self.scan(text, {}))
+
+    # Function to extract month names and charges
+    def parse_monthly_charges(self, section_text):
+        months = []
+        charges = []
+        for match in MONTH_CHARGE_RE.findall(section_text or ""):
+            if match[0]:  # Case where the month appears first
+                months.append(match[0])
+                charges.append(match[1])
+            else:  # Case where the charge appears first
+                charges.append(match[2])
+                months.append(match[3])
+        return months, charges
+
+    # Function to extract the detailed charges fields
+    def parse_detailed_charges(self, section_text):
+        section_text = section_text or ""
+        data = dict.fromkeys(DETAILED_CHARGES_KEYS, "")
+
+        total_usage_match = TOTAL_USAGE_RE.search(section_text)
+        if total_usage_match:
+            data["Total Usage (No ST)"] = total_usage_match.group(1).replace(" ", "")
+            data["Total Usage (ST)"] = total_usage_match.group(2).replace(" ", "")
+
+        icpt_match = ICPT_RE.search(section_text)
+        if icpt_match:
+            data["ICPT (No ST)"] = icpt_match.group(1).replace(" ", "")
+            data["ICPT (ST)"] = icpt_match.group(2).replace(" ", "")
+
+        kwtbb_match = KWTBB_RE.search(section_text)
+        if kwtbb_match:
+            data["KWTBB (1.6%)"] = kwtbb_match.group(1).replace(" ", "")
+
+        current_charge_match = CURRENT_CHARGE_RE.search(section_text)
+        if current_charge_match:
+            data["Current Charge"] = current_charge_match.group(1).replace(" ", "")
+
+        return data
+
+    # Function to extract the meter reading rows
+    def parse_meter_readings(self, section_text):
+        section_text = GLUED_UNIT_RE.sub(r"\1", section_text or "")
+        rows = []
+        for match in METER_ROW_RE.finditer(section_text):
+            rows.append({
+                "Meter Number": match.group(1).strip(),
+                "Previous Meter Reading": int(match.group(2).replace(",", "")),
+                "Current Meter Reading": int(match.group(3).replace(",", "")),
+                "Usage": int(match.group(4)),
+                "Unit": match.group(5).strip(),
+            })
+        return rows
+
+    # Function to extract the account number (digits only), or None
+    def parse_account_number(self, text):
+        match = ACCOUNT_RE.search(text or "")
+        return match.group(1).replace(" ", "") if match else None
+
+    # Function to build one bill record from the section texts (text is the full PDF text)
+    def build_record(self, sections, text=""):
+        months, charges = self.parse_monthly_charges(sections["monthly_charges"])
+        return {
+            "account_number": self.parse_account_number(text),
+            "months": months,
+            "charges": charges,
+            "detailed_charges": self.parse_detailed_charges(sections["detailed_charges"]),
+            "meter_readings": self.parse_meter_readings(sections["meter_reading"]),
+            "sections": sections,
+        }
+
+    # Function to parse the full PDF text into one bill record
+    def parse(self, text):
+        return self.build_record(self.find_sections(text), text)
+
+
+# Longest stretch of marker text that can straddle a page boundary
+MARKER_OVERLAP = 64
+
+
+class SectionScanner:
+
+    def __init__(self, bill_parser=None):
+        self.parser = bill_parser or parser
+        self.text = ""
+        self.state = {}
+
+    # Function to add the next page and scan only the new text
+    def feed(self, page_text):
+        resume = max(0, len(self.text) - MARKER_OVERLAP)
+        self.text += page_text
+        self.parser.scan(self.text, self.state, resume)
+
+    # Function to check whether every section has been closed
+    def complete(self):
+        return all(
+            self.state.get(name, (None, None))[1] is not None
+            for name, _, _, _ in SECTIONS
+        )
+
+    def sections(self):
+        return self.parser.section_texts(self.text, self.state)
+
+
+# Shared parser instance (all patterns are compiled at import time)
+parser = BillParser()
+
+
+def parse_bill(text):
+    return parser.parse(text)
+
+
+# Function to turn a parsed bill record into an electric_bills document
+def bill_document(bill, username=None):
+    detailed = bill["detailed_charges"]
+    meter_readings = bill["meter_readings"]
+    document = {
+        "username": username,
+        "Months": bill["months"],
+        "Charges": bill["charges"],
+        "Total Usage (No ST)": detailed.get('Total Usage (No ST)', []),
+        "Total Usage (ST)": detailed.get('Total Usage (ST)', []),
+        "ICPT (No ST)": detailed.get('ICPT (No ST)', []),
+        "ICPT (ST)": detailed.get('ICPT (ST)', []),
+        "KWTBB (1.6%)": detailed.get('KWTBB (1.6%)', []),
+        "Current Charge": detailed.get('Current Charge', []),
+        "Meter Numbers": [row["Meter Number"] for row in meter_readings],
+        "Previous Meter Reading": [row["Previous Meter Reading"] for row in meter_readings],
+        "Current Meter Reading": [row["Current Meter Reading"] for row in meter_readings],
+        "Usage": [row["Usage"] for row in meter_readings],
+        "Unit": [row["Unit"] for row in meter_readings],
+    }
+    # Typed copies of the amounts, periods and meter readings for aggregation
+    document.update(bill_schema.normalize_bill(document))
+    # Duplicate detection keys, only set when known (the unique indexes skip missing ones)
+    if bill.get("account_number"):
+        document["account_number"] = bill["account_number"]
+    if bill.get("digest"):
+        document["content_hashes"] = [bill["digest"]]
+    return document
+
+
+# Function to get a single section's text, or None when it is missing
+def section_text(text, name):
+    return parser.find_sections(text)[name]
+
+
+# Function to get the (start, end) of a section in raw text, tolerating broken spacing
+def loose_section_span(text, name):
+    start_re, end_re = LOOSE_SECTION_RES[name]
+    start = start_re.search(text)
+    if start is None:
+        return None
+    end = end_re.search(text, start.end())
+    if end is None:
+        return None
+    return start.start(), end.end()
@@ -0,0 +1,97 @@
+import re
+from datetime import datetime
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+# Version of the typed electric_bills fields written by normalize_bill
+SCHEMA_VERSION = 2
+
+# Malay month abbreviations used on TNB bills (e.g. "OGO-24")
+MALAY_MONTHS = {
+    "JAN": 1, "FEB": 2, "MAC": 3, "APR": 4, "MEI": 5, "JUN": 6,
+    "JUL": 7, "OGO": 8, "SEP": 9, "OKT": 10, "NOV": 11, "DIS": 12,
+}
+MONTH_CODES = {number: code for code, number in MALAY_MONTHS.items()}
+
+PERIOD_RE = re.compile(r"([A-Z]{3})-(\d{2})")
+AMOUNT_CLEAN_RE = re.compile(r"RM|,|\s")
+
+# Legacy string fields -> typed amount fields (in sen)
+DETAILED_AMOUNT_FIELDS = (
+    ("Total Usage (No ST)", "total_usage_no_st_sen"),
+    ("Total Usage (ST)", "total_usage_st_sen"),
+    ("ICPT (No ST)", "icpt_no_st_sen"),
+    ("ICPT (ST)", "icpt_st_sen"),
+    ("KWTBB (1.6%)", "kwtbb_sen"),
+    ("Current Charge", "current_charge_sen"),
+)
+
+
+# Function to turn a Malay month code like "OGO-24" into the first day of that month
+def parse_period(code):
+    match = PERIOD_RE.fullmatch((code or "").strip().upper())
+    if not match or match.group(1) not in MALAY_MONTHS:
+        return None
+    return datetime(2000 + int(match.group(2)), MALAY_MONTHS[match.group(1)], 1)
+
+
+# Function to turn an amount like "RM1,234.56" or "- 3.91" into integer sen
+def parse_amount_sen(text):
+    if isinstance(text, (int, float)):
+        return int((Decimal(str(text)) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+    cleaned = AMOUNT_CLEAN_RE.sub("", text or "")
+    if not cleaned:
+        return None
+    try:
+        return int((Decimal(cleaned) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+    except InvalidOperation:
+        return None
+
+
+def _to_int(value, default=0):
+    try:
+        return int(str(value).replace(",", ""))
+    except (TypeError, ValueError):
+        return default
+
+
+# Function to build the typed fields for an electric_bills document
+# Accepts both the current ("Months"/"Charges") and the older ("months"/"charges") layouts
+def normalize_bill(bill):
+    months = bill.get("Months") or bill.get("months") or []
+    charges = bill.get("Charges") or bill.get("charges") or []
+
+    periods = [parse_period(month) for month in months]
+    charges_sen = [parse_amount_sen(charge) for charge in charges]
+
+    meters = [
+        {
+            "meter_number": str(meter_number),
+            "previous_reading": _to_int(previous),
+            "current_reading": _to_int(current),
+            "usage": _to_int(usage),
+            "unit": unit or "kWh",
+        }
+        for meter_number, previous, current, usage, unit in zip(
+            bill.get("Meter Numbers", []),
+            bill.get("Previous Meter Reading", []),
+            bill.get("Current Meter Reading", []),
+            bill.get("Usage", []),
+            bill.get("Unit", []),
+        )
+    ]
+
+    typed = {
+        "periods": periods,
+        "charges_sen": charges_sen,
+        "billing_period": periods[-1] if periods else None,
+        "meters": meters,
+        "schema_version": SCHEMA_VERSION,
+    }
+    for legacy_field, typed_field in DETAILED_AMOUNT_FIELDS:
+        typed[typed_field] = parse_amount_sen(bill.get(legacy_field))
+    return typed
+
+
+# Function to turn a period datetime back into a Malay month code like "OGO-24"
+def format_period(period):
+    return f"{MONTH_CODES[period.month]}-{period.year % 100:02d}"
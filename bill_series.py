@@ -0,0 +1,87 @@
+from datetime import datetime
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+import bill_schema
+
+# One document per (username, period) with the charge for that month.
+# Each TNB bill repeats the previous six months, so overlapping bills upsert into
+# the same documents. On a conflict the bill with the later billing_period wins.
+SERIES_COLLECTION = 'electric_monthly_charges'
+SERIES_INDEX = 'username_period_unique'  # Unique (username, period), see mongo.INDEXES
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+# Function to build the upserts for every month of one bill
+def series_updates(username, bill):
+    months = bill.get("Months") or bill.get("months") or []
+    charges = bill.get("Charges") or bill.get("charges") or []
+    periods = bill.get("periods")
+    charges_sen = bill.get("charges_sen")
+    if periods is None or charges_sen is None:
+        typed = bill_schema.normalize_bill(bill)
+        periods, charges_sen = typed["periods"], typed["charges_sen"]
+
+    valid_periods = [period for period in periods if period is not None]
+    if not valid_periods:
+        return []
+    billing_period = max(valid_periods)
+
+    updates = []
+    for month, charge, period, sen in zip(months, charges, periods, charges_sen):
+        if period is None or sen is None:
+            continue
+        updates.append(UpdateOne(
+            # Only overwrite values that came from the same or an older bill
+            {"username": username, "period": period,
+             "$or": [{"source_billing_period": {"$lte": billing_period}},
+                     {"source_billing_period": {"$exists": False}}]},
+            {"$set": {
+                "month": month,
+                "charge": charge,
+                "charge_sen": sen,
+                "source_billing_period": billing_period,
+                "updated_at": datetime.utcnow(),
+            }},
+            upsert=True,
+        ))
+    return updates
+
+
+# Function to upsert the months of one or more bills into the time series
+def record_bills(db, username, bills):
+    updates = [update for bill in bills for update in series_updates(username, bill)]
+    if not updates:
+        return
+    try:
+        db[SERIES_COLLECTION].bulk_write(updates, ordered=False)
+    except BulkWriteError as e:
+        # A duplicate key means a newer bill already owns that month; anything else is real
+        errors = [error for error in e.details.get("writeErrors", []) if error["code"] != DUPLICATE_KEY_ERROR]
+        if errors or e.details.get("writeConcernErrors"):
+            raise
+
+
+def record_bill(db, username, bill):
+    record_bills(db, username, [bill])
+
+
+# Function to get the user's (month, charge) pairs in date order for charts
+def series_pairs(db, username):
+    rows = db[SERIES_COLLECTION].find(
+        {"username": username},
+        {"_id": 0, "month": 1, "charge": 1},
+    ).sort("period", 1)
+    return [(row["month"], row["charge"]) for row in rows]
+
+
+# Function to rebuild a user's series from their stored bills (backfill)
+def rebuild_series(db, username):
+    db[SERIES_COLLECTION].delete_many({"username": username})
+    bills = db['electric_bills'].find(
+        {"username": username},
+        {"_id": 0, "Months": 1, "Charges": 1, "months": 1, "charges": 1, "periods": 1, "charges_sen": 1},
+    )
+    record_bills(db, username, list(bills))
@@ -0,0 +1,50 @@
+# Dashboard statistics computed by MongoDB aggregation pipelines (amounts are stored in sen)
+
+
+# Stages selecting a user's usable bills with their last month and charge, in upload order
+# (same bills and order as user_bill_summary.last_months, both "Months" and "months" layouts)
+def _bill_stages(username):
+    return [
+        {"$match": {"username": username, "$or": [{"Months.0": {"$exists": True}}, {"months.0": {"$exists": True}}]}},
+        {"$sort": {"_id": 1}},
+        {"$project": {
+            "_id": 0,
+            "Months": {"$ifNull": ["$Months", "$months"]},
+            "Charges": {"$ifNull": ["$Charges", "$charges"]},
+            "charges_sen": 1,
+        }},
+        {"$project": {
+            "Months": 1,
+            "Charges": 1,
+            "charges_sen": 1,
+            "last_month": {"$arrayElemAt": ["$Months", -1]},
+            "last_charge_sen": {"$arrayElemAt": ["$charges_sen", -1]},
+        }},
+        {"$match": {"last_charge_sen": {"$ne": None}}},
+    ]
+
+
+# Function to get one bill (by its position in the dropdown) with its average and maximum charge
+def selected_bill_stats(db, username, month_index):
+    pipeline = _bill_stages(username) + [
+        {"$skip": month_index},
+        {"$limit": 1},
+        {"$project": {
+            "Months": 1,
+            "Charges": 1,
+            "last_month": 1,
+            "avg_sen": {"$avg": "$charges_sen"},
+            "max_sen": {"$max": "$charges_sen"},
+        }},
+    ]
+    bill = next(db['electric_bills'].aggregate(pipeline), None)
+    if bill is None:
+        return None
+
+    return {
+        "bill": {"Months": bill["Months"], "Charges": bill["Charges"]},
+        "selected_month": bill["last_month"],
+        "selected_charge": bill["Charges"][-1],
+        "avg_monthly_charge": (bill["avg_sen"] or 0) / 100,
+        "max_charge": (bill["max_sen"] or 0) / 100,
+    }
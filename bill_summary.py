@@ -0,0 +1,66 @@
+from pymongo import UpdateOne
+
+import bill_schema
+
+# One small document per user in user_bill_summary, updated on every bill insert:
+#   bill_count / charge_sum_sen / charge_max_sen  - running stats over each bill's latest charge
+#   last_months                                   - latest month of each bill, in upload order
+#   latest_months / latest_charges                - month and charge lists of the newest bill
+# The deduplicated month -> charge series lives in its own collection (see bill_series.py)
+SUMMARY_COLLECTION = 'user_bill_summary'
+
+
+# Function to build the summary update for one newly inserted bill
+def summary_update(bill):
+    months = bill.get("Months") or bill.get("months") or []
+    charges = bill.get("Charges") or bill.get("charges") or []
+    charges_sen = bill.get("charges_sen")
+    if charges_sen is None:
+        charges_sen = bill_schema.normalize_bill(bill)["charges_sen"]
+
+    update = {"$set": {"latest_months": months, "latest_charges": charges}}
+
+    if months and charges_sen and charges_sen[-1] is not None:
+        update["$inc"] = {"bill_count": 1, "charge_sum_sen": charges_sen[-1]}
+        update["$max"] = {"charge_max_sen": charges_sen[-1]}
+        update["$push"] = {"last_months": months[-1]}
+    return update
+
+
+# Function to fold a newly inserted bill into the user's summary (one atomic upsert)
+def record_bill(db, username, bill):
+    db[SUMMARY_COLLECTION].update_one({"_id": username}, summary_update(bill), upsert=True)
+
+
+# Function to fold several bills of one user into the summary, in order
+def record_bills(db, username, bills):
+    updates = [UpdateOne({"_id": username}, summary_update(bill), upsert=True) for bill in bills]
+    if updates:
+        db[SUMMARY_COLLECTION].bulk_write(updates, ordered=True)
+
+
+# Function to recompute a user's summary from their stored bills (backfill)
+def rebuild_summary(db, username):
+    db[SUMMARY_COLLECTION].delete_one({"_id": username})
+    bills = db['electric_bills'].find(
+        {"username": username},
+        {"_id": 0, "Months": 1, "Charges": 1, "months": 1, "charges": 1, "charges_sen": 1},
+    ).sort("_id", 1)
+    for bill in bills:
+        record_bill(db, username, bill)
+
+
+def get_summary(db, username):
+    return db[SUMMARY_COLLECTION].find_one({"_id": username}) or {}
+
+
+# Function to turn a summary into the dashboard statistics
+def summary_stats(summary):
+    count = summary.get("bill_count", 0)
+    return {
+        "last_months": summary.get("last_months", []),
+        "avg_monthly_charge": summary.get("charge_sum_sen", 0) / count / 100 if count else 0,
+        "max_charge": summary.get("charge_max_sen", 0) / 100 if count else 0,
+        "charges": summary.get("latest_charges", []),
+    }
+
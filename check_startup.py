@@ -0,0 +1,63 @@
+import json
+import os
+import subprocess
+import sys
+
+# Cold-start budget check for the Flask apps: python check_startup.py
+# Each app is imported and built with create_app() in a fresh interpreter; the check fails
+# when that takes longer than the budget or pulls in a dependency that should load lazily.
+ROOT = os.path.dirname(os.path.abspath(__file__))
+STARTUP_BUDGET_SECONDS = float(os.environ.get('STARTUP_BUDGET_SECONDS', '2.0'))
+DEFERRED_MODULES = ('pandas', 'plotly', 'malaya')
+
+APPS = (
+    ('app.py', ROOT),
+    ('pro16.py', ROOT),
+    ('app-version-dropdown-menu/app.py', os.path.join(ROOT, 'app-version-dropdown-menu')),
+)
+
+PROBE = """
+import importlib.util, json, sys, time
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location("startup_probe", sys.argv[1])
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+module.create_app()
+seconds = time.perf_counter() - start
+print(json.dumps({"seconds": seconds, "loaded": [name for name in sys.argv[2].split(",") if name in sys.modules]}))
+"""
+
+
+# Function to time one app's import + create_app() and list deferred modules it loaded
+def measure(path, cwd):
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE, os.path.join(ROOT, path), ",".join(DEFERRED_MODULES)],
+        cwd=cwd, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        return None, [], result.stderr.strip().splitlines()[-1:]
+    # The report is the probe's last line (the app may print before it)
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    return report["seconds"], report["loaded"], []
+
+
+def main():
+    failed = False
+    for path, cwd in APPS:
+        seconds, loaded, errors = measure(path, cwd)
+        if errors:
+            print(f"FAIL {path}: {errors[0]}")
+            failed = True
+            continue
+        problems = []
+        if seconds > STARTUP_BUDGET_SECONDS:
+            problems.append(f"over budget ({STARTUP_BUDGET_SECONDS:.2f}s)")
+        if loaded:
+            problems.append(f"imported {', '.join(loaded)} at startup")
+        failed = failed or bool(problems)
+        print(f"{'FAIL' if problems else 'ok  '} {path}: {seconds:.3f}s {'; '.join(problems)}".rstrip())
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,160 @@
+import logging
+from datetime import datetime
+
+import numpy as np
+from pymongo import UpdateOne
+
+import bill_schema
+import bill_series
+import forecast_service
+import mongo
+
+# Nightly job: forecast every user at once with array operations instead of a per-user loop
+# (same trend + month-of-year model as forecast_service.ChargeForecaster)
+FORECAST_COLLECTION = 'electric_forecasts'
+WRITE_BATCH_SIZE = 1000
+TRAINING_FIELDS = {name: 1 for name in ("username", "period", "charge_sen", "Months", "months", "Charges", "charges")}
+
+logger = logging.getLogger(__name__)
+
+
+def _month_index(period):
+    return period.year * 12 + period.month - 1
+
+
+def _period(month_index):
+    return datetime(int(month_index) // 12, int(month_index) % 12 + 1, 1)
+
+
+# Function to load {username: {month index: charge in sen}} from train_collection
+# Nothing in this repo writes that collection, so two layouts are accepted:
+#   monthly rows  {"username", "period": date, "charge_sen": number}
+#   bill-shaped   {"username", "Months"/"months", "Charges"/"charges"} as stored in electric_bills
+# Returns (series, skipped rows); rows in neither layout are counted instead of silently ignored
+def load_training_series(db, train_collection='electric_consumption'):
+    series = {}
+    skipped = 0
+    rows = db[train_collection].find({"username": {"$exists": True}}, {"_id": 0, **TRAINING_FIELDS})
+    for row in rows:
+        period, charge_sen = row.get("period"), row.get("charge_sen")
+        if isinstance(period, datetime) and isinstance(charge_sen, (int, float)):
+            series.setdefault(row["username"], {})[_month_index(period)] = charge_sen
+        elif row.get("Months") or row.get("months"):
+            typed = bill_schema.normalize_bill(row)
+            months = series.setdefault(row["username"], {})
+            for period, charge_sen in zip(typed["periods"], typed["charges_sen"]):
+                if period is not None and charge_sen is not None:
+                    months[_month_index(period)] = charge_sen
+        else:
+            skipped += 1
+    return series, skipped
+
+
+# Function to load {username: {month index: charge in sen}} for every user
+# electric_monthly_charges (built from electric_bills) wins over train_collection on overlap
+def load_all_series(db, train_collection='electric_consumption'):
+    series, skipped = load_training_series(db, train_collection)
+    if skipped:
+        logger.warning("Skipped %d %s row(s) in neither the monthly nor the bill layout", skipped, train_collection)
+
+    grouped = db[bill_series.SERIES_COLLECTION].aggregate([
+        {"$match": {"charge_sen": {"$ne": None}}},
+        {"$group": {"_id": "$username", "periods": {"$push": "$period"}, "charges": {"$push": "$charge_sen"}}},
+    ], allowDiskUse=True)
+    for user in grouped:
+        months = series.setdefault(user["_id"], {})
+        for period, charge_sen in zip(user["periods"], user["charges"]):
+            months[_month_index(period)] = charge_sen
+    return series
+
+
+# Function to pack the series into a (users x months) array padded with NaN
+def build_matrix(series):
+    usernames = sorted(series)
+    all_months = [month for months in series.values() for month in months]
+    origin = min(all_months)
+    width = max(all_months) - origin + 1
+
+    values = np.full((len(usernames), width), np.nan)
+    for row, username in enumerate(usernames):
+        months = series[username]
+        values[row, np.fromiter(months.keys(), dtype=np.int64) - origin] = np.fromiter(months.values(), dtype=float)
+    return usernames, origin, values
+
+
+# Function to fit trend + seasonal offsets for every row and forecast `horizon` months
+def forecast_matrix(values, origin, horizon=forecast_service.FORECAST_HORIZON):
+    mask = ~np.isnan(values)
+    y = np.where(mask, values, 0.0)
+    t = np.arange(values.shape[1], dtype=float)
+
+    # Per-row least-squares line over the observed months only
+    n = mask.sum(axis=1)
+    safe_n = np.maximum(n, 1)
+    mean_t = (mask * t).sum(axis=1) / safe_n
+    mean_y = y.sum(axis=1) / safe_n
+    dt = np.where(mask, t - mean_t[:, None], 0.0)
+    var_t = (dt ** 2).sum(axis=1)
+    slope = np.divide((dt * (y - mean_y[:, None])).sum(axis=1), var_t, out=np.zeros_like(var_t), where=var_t > 0)
+    intercept = mean_y - slope * mean_t
+
+    # Mean residual per calendar month, only for users with enough history
+    residual = np.where(mask, y - (intercept[:, None] + slope[:, None] * t), 0.0)
+    calendar_month = (origin + t.astype(np.int64)) % 12
+    seasonal = np.zeros((values.shape[0], 12))
+    for month in range(12):
+        columns = calendar_month == month
+        counts = mask[:, columns].sum(axis=1)
+        sums = residual[:, columns].sum(axis=1)
+        seasonal[:, month] = np.divide(sums, counts, out=np.zeros_like(sums), where=counts > 0)
+    seasonal[n < forecast_service.SEASONAL_HISTORY] = 0.0
+
+    # Forecast from each user's last observed month
+    last = values.shape[1] - 1 - np.argmax(mask[:, ::-1], axis=1)
+    future_t = last[:, None] + np.arange(1, horizon + 1)
+    future_month = (origin + future_t) % 12
+    forecast = intercept[:, None] + slope[:, None] * future_t + np.take_along_axis(seasonal, future_month, axis=1)
+    return np.clip(forecast, 0.0, None), origin + future_t, n
+
+
+# Function to write the forecasts back with batched bulk upserts
+def write_forecasts(db, usernames, forecast, future_months, history, generated_at):
+    updates = []
+    written = 0
+    for row, username in enumerate(usernames):
+        if history[row] < forecast_service.MIN_HISTORY:
+            continue
+        entries = [
+            (_period(month), sen) for month, sen in zip(future_months[row], forecast[row])
+        ]
+        updates.append(UpdateOne(
+            {"_id": username},
+            {"$set": {
+                "forecast": forecast_service.format_forecast(entries),
+                "generated_at": generated_at,
+                "method": "batch",
+            }},
+            upsert=True,
+        ))
+        if len(updates) >= WRITE_BATCH_SIZE:
+            written += len(updates)
+            db[FORECAST_COLLECTION].bulk_write(updates, ordered=False)
+            updates = []
+    if updates:
+        written += len(updates)
+        db[FORECAST_COLLECTION].bulk_write(updates, ordered=False)
+    return written
+
+
+def run(db):
+    series = load_all_series(db)
+    if not series:
+        return 0
+    usernames, origin, values = build_matrix(series)
+    forecast, future_months, history = forecast_matrix(values, origin)
+    return write_forecasts(db, usernames, forecast, future_months, history, datetime.utcnow())
+
+
+if __name__ == '__main__':
+    count = run(mongo.get_db())
+    print(f"Wrote forecasts for {count} user(s) to {FORECAST_COLLECTION}")
@@ -0,0 +1,264 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import bill_schema
+import bill_series
+import model_registry
+
+# Forecast settings
+FORECAST_HORIZON = 6  # Months to predict
+MIN_HISTORY = 3  # Months of data needed before a forecast is made
+SEASONAL_HISTORY = 24  # Months of data needed before month-of-year effects are used
+TRAINING_WORKERS = 2
+
+
+# Function to load a user's monthly charges (in sen) from the time series, oldest first
+def load_series(db, username):
+    rows = db[bill_series.SERIES_COLLECTION].find(
+        {"username": username},
+        {"_id": 0, "period": 1, "charge_sen": 1},
+    ).sort("period", 1)
+    return [(row["period"], row["charge_sen"]) for row in rows]
+
+
+def _add_months(period, months):
+    index = period.year * 12 + period.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def _month_index(period):
+    return period.year * 12 + period.month - 1
+
+
+class ChargeForecaster:
+    # Linear trend on the monthly charge plus month-of-year offsets once two years are known
+    # Kept as running sums, so a new or corrected month is an O(1) update instead of a refit
+
+    def __init__(self):
+        self.intercept = 0.0
+        self.slope = 0.0
+        self.seasonal = {}
+        self.origin = None
+        self.last_period = None
+        self.months = {}  # month index -> charge in sen
+        self.sums = [0, 0.0, 0.0, 0.0, 0.0]  # n, sum t, sum value, sum t*t, sum t*value
+        self.month_sums = {}  # calendar month -> [n, sum t, sum value]
+
+    def _add(self, t, calendar_month, value, sign):
+        self.sums[0] += sign
+        self.sums[1] += sign * t
+        self.sums[2] += sign * value
+        self.sums[3] += sign * t * t
+        self.sums[4] += sign * t * value
+        month = self.month_sums.setdefault(calendar_month, [0, 0.0, 0.0])
+        month[0] += sign
+        month[1] += sign * t
+        month[2] += sign * value
+        if not month[0]:
+            del self.month_sums[calendar_month]
+
+    # Function to add a month's charge, replacing any earlier value for that month
+    def update(self, period, value):
+        index = _month_index(period)
+        if self.origin is None:
+            self.origin = index
+        t = index - self.origin
+        if index in self.months:
+            self._add(t, period.month, self.months[index], -1)
+        self.months[index] = value
+        self._add(t, period.month, value, 1)
+        if self.last_period is None or period > self.last_period:
+            self.last_period = period
+        return self
+
+    # Function to recompute the line and month offsets from the running sums
+    def solve(self):
+        n, sum_t, sum_v, sum_tt, sum_tv = self.sums
+        mean_t = sum_t / n
+        mean_v = sum_v / n
+        var_t = sum_tt - sum_t * mean_t
+        # Tiny variances are float noise from removed months, treat them as a single point in time
+        self.slope = (sum_tv - sum_t * mean_v) / var_t if var_t > 1e-9 else 0.0
+        self.intercept = mean_v - self.slope * mean_t
+
+        # Average residual per calendar month, straight from the per-month sums
+        self.seasonal = {}
+        if n >= SEASONAL_HISTORY:
+            self.seasonal = {
+                month: (month_v - self.intercept * count - self.slope * month_t) / count
+                for month, (count, month_t, month_v) in self.month_sums.items()
+            }
+        return self
+
+    def fit(self, periods, values):
+        self.__init__()
+        for period, value in zip(periods, values):
+            self.update(period, value)
+        return self.solve()
+
+    def predict(self, horizon=FORECAST_HORIZON):
+        forecast = []
+        for step in range(1, horizon + 1):
+            period = _add_months(self.last_period, step)
+            x = _month_index(period) - self.origin
+            value = self.intercept + self.slope * x + self.seasonal.get(period.month, 0.0)
+            forecast.append((period, max(value, 0.0)))
+        return forecast
+
+
+# Function to format a forecast for JSON responses (charges in RM)
+def format_forecast(forecast):
+    return [
+        {"period": period.strftime("%Y-%m"), "month": bill_schema.format_period(period), "charge": round(sen / 100, 2)}
+        for period, sen in forecast
+    ]
+
+
+class ForecastService:
+    # Long-lived, in-process forecaster: models stay in memory and retrain on a thread pool
+
+    def __init__(self, get_db, horizon=FORECAST_HORIZON):
+        self.get_db = get_db
+        self.horizon = horizon
+        self.models = {}  # username -> {"model", "forecast", "trained_at", "fingerprint"}
+        self.training = {}  # username -> Future
+        self.errors = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=TRAINING_WORKERS, thread_name_prefix="forecast")
+
+    def fingerprint(self, username):
+        return model_registry.data_fingerprint(self.get_db(), username, bill_series.SERIES_COLLECTION)
+
+    # Function to fit and store a user's model (runs on the training pool)
+    def train(self, username):
+        db = self.get_db()
+        # Fingerprint first, so bills arriving mid-training make the result stale, not lost
+        fingerprint = self.fingerprint(username)
+        series = load_series(db, username)
+
+        # Too little history is remembered too, so it is not retried until new bills arrive
+        model = None
+        forecast = []
+        if len(series) >= MIN_HISTORY:
+            periods = [period for period, _ in series]
+            values = [sen for _, sen in series]
+            model = ChargeForecaster().fit(periods, values)
+            forecast = model.predict(self.horizon)
+
+        entry = {"model": model, "forecast": forecast, "trained_at": time.time(), "fingerprint": fingerprint}
+        model_registry.save(username, fingerprint, entry)
+        with self.lock:
+            self.models[username] = entry
+        return entry
+
+    def _training_done(self, username, future):
+        with self.lock:
+            self.training.pop(username, None)
+            error = future.exception()
+            if error is None:
+                self.errors.pop(username, None)
+            else:
+                self.errors[username] = repr(error)
+
+    # Function to start a background retrain unless one is already running
+    def retrain_async(self, username):
+        with self.lock:
+            if username in self.training:
+                return
+            future = self.executor.submit(self.train, username)
+            self.training[username] = future
+        future.add_done_callback(lambda done: self._training_done(username, done))
+
+    # bill_events listener: runs the update on the training pool, off the publisher's thread
+    def on_bill_ingested(self, username, periods):
+        self.executor.submit(self.update_from_bill, username, periods)
+
+    # Function to fold a newly ingested bill into the user's model
+    # Reads only the bill's months back from the series, so the cost does not grow with history
+    def update_from_bill(self, username, periods):
+        with self.lock:
+            entry = self.models.get(username)
+            training = username in self.training
+        if training:
+            return
+        model = entry["model"] if entry else None
+        if model is None or not hasattr(model, "months"):
+            # Nothing to warm-start from (or a model saved before running sums existed)
+            self.retrain_async(username)
+            return
+
+        db = self.get_db()
+        # Fingerprint first, as in train(), so a concurrent write leaves the entry stale, not wrong
+        fingerprint = self.fingerprint(username)
+        rows = list(db[bill_series.SERIES_COLLECTION].find(
+            {"username": username, "period": {"$in": periods}},
+            {"_id": 0, "period": 1, "charge_sen": 1},
+        ))
+
+        with self.lock:
+            if self.models.get(username) is not entry:
+                return
+            for row in rows:
+                if row.get("charge_sen") is not None:
+                    model.update(row["period"], row["charge_sen"])
+            model.solve()
+            entry = {"model": model, "forecast": model.predict(self.horizon),
+                     "trained_at": time.time(), "fingerprint": fingerprint}
+            self.models[username] = entry
+        model_registry.save(username, fingerprint, entry)
+
+    # Function to report the current state of a user's forecast
+    def status(self, username):
+        with self.lock:
+            entry = self.models.get(username)
+            training = username in self.training
+            error = self.errors.get(username)
+
+        if training:
+            result = {"status": "training"}
+        elif entry is None:
+            result = {"status": "no_forecast"}
+        elif entry["model"] is None:
+            result = {"status": "not_enough_data", "min_history": MIN_HISTORY}
+        else:
+            result = {"status": "ready"}
+        if error and not training:
+            result["status"] = "failed"
+            result["error"] = error
+        if entry:
+            result["forecast"] = format_forecast(entry["forecast"])
+            result["trained_at"] = entry["trained_at"]
+            result["fingerprint"] = entry.get("fingerprint")
+        return result
+
+    # Function to get a forecast, retraining only when the user's data changed since the last fit
+    def predict(self, username):
+        fingerprint = self.fingerprint(username)
+        with self.lock:
+            entry = self.models.get(username)
+        if entry and entry.get("fingerprint") == fingerprint:
+            return self.status(username)
+
+        # Another worker (or an earlier run) may already have trained on this data
+        stored = model_registry.load(username, fingerprint)
+        if stored is not None:
+            with self.lock:
+                self.models[username] = stored
+        else:
+            self.retrain_async(username)
+        return self.status(username)
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+# Function to get the process-wide forecast service (created on first use)
+def get_service(get_db):
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = ForecastService(get_db)
+        return _service
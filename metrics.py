@@ -0,0 +1,162 @@
+import multiprocessing
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+from flask import Response, g, request
+
+import app_log
+
+# In-process counters and histograms, exposed in Prometheus text format at /metrics.
+# With METRICS_ENABLED=0 every call returns straight away and stage() hands out a shared no-op.
+ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+STAGE_HISTOGRAM = 'bill_stage_duration_seconds'
+REQUEST_HISTOGRAM = 'http_request_duration_seconds'
+
+_counters = {}  # (name, labels) -> value
+_histograms = {}  # (name, labels) -> [cumulative bucket counts..., sum, count]
+_lock = threading.Lock()
+_NOOP = nullcontext()
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+# Function to add to a counter, e.g. inc('bill_extraction_failures_total', reason='no_charges_section')
+def inc(name, amount=1, **labels):
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+# Function to record one duration (in seconds) in a histogram
+def observe(name, seconds, **labels):
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [0] * len(BUCKETS) + [0.0, 0]
+        for index, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                histogram[index] += 1
+        histogram[-2] += seconds
+        histogram[-1] += 1
+
+
+class _Timer:
+    __slots__ = ("labels", "start")
+
+    def __init__(self, stage_name):
+        self.labels = {"stage": stage_name}
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.start
+        observe(STAGE_HISTOGRAM, seconds, **self.labels)
+        app_log.record_stage(self.labels["stage"], seconds)
+        return False
+
+
+# Function to time a pipeline stage: with metrics.stage("mongo_insert"): ...
+# The duration also goes into the request's log record (see app_log)
+def stage(name):
+    return _Timer(name) if ENABLED or app_log.collecting_stages() else _NOOP
+
+
+def _format_labels(labels, extra=()):
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+# Function to render every metric in the Prometheus text exposition format
+def render():
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted((key, list(values)) for key, values in _histograms.items())
+
+    lines = []
+    typed = set()
+    for (name, labels), value in counters:
+        if name not in typed:
+            lines.append(f"# TYPE {name} counter")
+            typed.add(name)
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+    for (name, labels), values in histograms:
+        if name not in typed:
+            lines.append(f"# TYPE {name} histogram")
+            typed.add(name)
+        for bound, count in zip(BUCKETS, values):
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {count}")
+        lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {values[-1]}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {values[-2]}")
+        lines.append(f"{name}_count{_format_labels(labels)} {values[-1]}")
+    return "\n".join(lines) + "\n"
+
+
+# Function to take (and clear) everything recorded so far in this process
+def drain():
+    global _counters, _histograms
+    with _lock:
+        snapshot = (_counters, _histograms)
+        _counters, _histograms = {}, {}
+    return snapshot
+
+
+# Function to add metrics drained in another process (a pool worker) to this one
+def merge(snapshot):
+    if not ENABLED or not snapshot:
+        return
+    counters, histograms = snapshot
+    with _lock:
+        for key, value in counters.items():
+            _counters[key] = _counters.get(key, 0) + value
+        for key, values in histograms.items():
+            histogram = _histograms.get(key)
+            if histogram is None:
+                _histograms[key] = list(values)
+            else:
+                for index, value in enumerate(values):
+                    histogram[index] += value
+
+
+# Function to run func(*args) in a pool worker and return (result, metrics it recorded)
+# The worker's registry is cleared first, since a forked worker inherits its parent's
+def run_collecting(func, *args):
+    if multiprocessing.parent_process() is None:
+        # Not in a worker: the metrics are already recorded in this process
+        return func(*args), None
+    drain()
+    result = func(*args)
+    return result, drain()
+
+
+# Function to add request timing hooks and the /metrics route to a Flask app
+def init_app(app):
+    if ENABLED:
+        @app.before_request
+        def _start_request_timer():
+            g.metrics_start = time.perf_counter()
+
+        @app.after_request
+        def _record_request(response):
+            start = g.pop('metrics_start', None)
+            if start is not None:
+                observe(REQUEST_HISTOGRAM, time.perf_counter() - start,
+                        endpoint=request.endpoint or "unknown", method=request.method,
+                        status=str(response.status_code))
+            return response
+
+    app.add_url_rule('/metrics', 'metrics', lambda: Response(render(), mimetype='text/plain; version=0.0.4'))
@@ -0,0 +1,62 @@
+from pymongo import UpdateOne
+from pymongo.errors import OperationFailure
+
+import bill_schema
+import bill_series
+import bill_summary
+import mongo
+
+# One-time migration: add the typed fields from bill_schema to existing electric_bills documents
+BATCH_SIZE = 500
+
+
+# Function to stream unmigrated bills and update them in bulk batches
+def migrate(db, batch_size=BATCH_SIZE):
+    bills = db['electric_bills']
+    # Whole documents: "KWTBB (1.6%)" cannot be named in a projection (Mongo reads the "." as a path)
+    cursor = bills.find(
+        {"schema_version": {"$ne": bill_schema.SCHEMA_VERSION}},
+        batch_size=batch_size,
+    )
+
+    migrated = 0
+    updates = []
+    for bill in cursor:
+        updates.append(UpdateOne({"_id": bill["_id"]}, {"$set": bill_schema.normalize_bill(bill)}))
+        if len(updates) >= batch_size:
+            migrated += bills.bulk_write(updates, ordered=False).modified_count
+            updates = []
+    if updates:
+        migrated += bills.bulk_write(updates, ordered=False).modified_count
+    return migrated
+
+
+# Function to create the indexes before rebuilding: the series upserts rely on
+# username_period_unique to resolve overlapping bills, without it they insert duplicate months
+def ensure_series_index(db):
+    try:
+        mongo.ensure_indexes(db, required=(bill_series.SERIES_INDEX,))
+    except OperationFailure as e:
+        if e.code != bill_series.DUPLICATE_KEY_ERROR:
+            raise
+        # Duplicate months left by a run without the index; every series is rebuilt below anyway
+        db[bill_series.SERIES_COLLECTION].delete_many({})
+        mongo.ensure_indexes(db, required=(bill_series.SERIES_INDEX,))
+
+
+# Function to rebuild every user's bill summary and monthly series from the migrated bills
+def rebuild_summaries(db):
+    usernames = db['electric_bills'].distinct('username')
+    for username in usernames:
+        bill_summary.rebuild_summary(db, username)
+        bill_series.rebuild_series(db, username)
+    return len(usernames)
+
+
+if __name__ == '__main__':
+    db = mongo.get_db()
+    ensure_series_index(db)
+    count = migrate(db)
+    print(f"Migrated {count} electric bill(s) to schema version {bill_schema.SCHEMA_VERSION}")
+    users = rebuild_summaries(db)
+    print(f"Rebuilt bill summaries and monthly series for {users} user(s)")
@@ -0,0 +1,61 @@
+import hashlib
+import json
+import os
+import pickle
+
+import artifacts
+
+# Trained forecasters are stored per user, one file per data fingerprint
+REGISTRY_FOLDER = os.path.join('cache', 'models')
+VERSIONS_KEPT = 3  # Older fingerprints per user are deleted
+
+
+# Hashed, so each user's pruning only ever touches that user's own models
+def _user_folder(username):
+    return os.path.join(REGISTRY_FOLDER, artifacts.owner_key(username))
+
+
+# Function to fingerprint the data a user's forecaster is trained on
+# Uses counts and latest change markers so it costs two indexed queries, not a full read
+def data_fingerprint(db, username, series_collection, train_collection='electric_consumption'):
+    latest_series = db[series_collection].find_one(
+        {"username": username}, {"_id": 0, "updated_at": 1}, sort=[("updated_at", -1)])
+    latest_train = db[train_collection].find_one(
+        {"username": username}, {"_id": 1}, sort=[("_id", -1)])
+
+    state = {
+        "series_count": db[series_collection].count_documents({"username": username}),
+        "series_updated": str(latest_series["updated_at"]) if latest_series else None,
+        "train_count": db[train_collection].count_documents({"username": username}),
+        "train_last_id": str(latest_train["_id"]) if latest_train else None,
+    }
+    return hashlib.sha256(json.dumps(state, sort_keys=True).encode()).hexdigest()[:32]
+
+
+# Function to load a stored model entry, or None when this fingerprint was never trained
+def load(username, fingerprint):
+    path = os.path.join(_user_folder(username), f"{fingerprint}.pkl")
+    try:
+        with open(path, 'rb') as file:
+            entry = pickle.load(file)
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+        return None
+    os.utime(path)
+    return entry
+
+
+# Function to store a trained model entry and prune old versions
+def save(username, fingerprint, entry):
+    folder = _user_folder(username)
+    with artifacts.atomic_open(os.path.join(folder, f"{fingerprint}.pkl"), 'wb') as file:
+        pickle.dump(entry, file)
+
+    versions = sorted(
+        (os.path.getmtime(os.path.join(folder, name)), name)
+        for name in os.listdir(folder) if name.endswith('.pkl')
+    )
+    for _, name in versions[:-VERSIONS_KEPT]:
+        try:
+            os.remove(os.path.join(folder, name))
+        except FileNotFoundError:
+            pass
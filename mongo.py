@@ -0,0 +1,178 @@
+import logging
+import os
+import threading
+import time
+
+from pymongo import MongoClient, ASCENDING, DESCENDING, monitoring
+from pymongo.errors import OperationFailure, PyMongoError
+
+# MongoDB connection setup
+MONGO_URI = os.environ.get('MONGO_URI', 'mongodb://localhost:27017/')  # Replace with your MongoDB URI
+DB_NAME = os.environ.get('MONGO_DB', 'Workshop2')  # Replace with your database name
+
+# Connection pool settings, so a slow Mongo makes requests fail fast instead of hanging
+CLIENT_SETTINGS = {
+    "maxPoolSize": int(os.environ.get('MONGO_MAX_POOL_SIZE', '50')),
+    "minPoolSize": int(os.environ.get('MONGO_MIN_POOL_SIZE', '0')),
+    "waitQueueTimeoutMS": int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', '2000')),
+    "serverSelectionTimeoutMS": int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '3000')),
+    "connectTimeoutMS": int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', '5000')),
+    "socketTimeoutMS": int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', '30000')),
+    "readPreference": os.environ.get('MONGO_READ_PREFERENCE', 'primary'),
+}
+
+# Health check settings
+HEALTH_COLLECTIONS = ('user', 'electric_bills', 'electric_monthly_charges')
+HEALTH_SLOW_MS = float(os.environ.get('MONGO_HEALTH_SLOW_MS', '500'))  # Slower than this reports "degraded"
+HEALTH_TIMEOUT_MS = 1000
+
+JOB_TTL_SECONDS = int(os.environ.get('JOB_TTL_SECONDS', str(7 * 24 * 60 * 60)))  # Ingestion job statuses expire
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    # Counts connection pool events, since pymongo has no public API for pool usage
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {
+            "open": 0, "checked_out": 0, "waiting": 0,
+            "created": 0, "closed": 0, "checkout_failures": 0, "pool_clears": 0,
+        }
+
+    def _change(self, **deltas):
+        with self.lock:
+            for name, delta in deltas.items():
+                self.counts[name] += delta
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counts)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._change(pool_clears=1)
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._change(open=1, created=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._change(open=-1, closed=1)
+
+    def connection_check_out_started(self, event):
+        self._change(waiting=1)
+
+    def connection_check_out_failed(self, event):
+        self._change(waiting=-1, checkout_failures=1)
+
+    def connection_checked_out(self, event):
+        self._change(waiting=-1, checked_out=1)
+
+    def connection_checked_in(self, event):
+        self._change(checked_out=-1)
+
+
+pool_stats = PoolStats()
+
+_client = None
+_client_pid = None
+_indexes_ready = False
+_indexes_lock = threading.Lock()
+logger = logging.getLogger(__name__)
+
+
+# Function to get the database, opening one client per process
+# (MongoClient is not fork-safe, so pool workers get their own)
+def get_db():
+    global _client, _client_pid, pool_stats
+    if _client is None or _client_pid != os.getpid():
+        # Fresh counters too, a forked worker must not report its parent's connections
+        pool_stats = PoolStats()
+        _client = MongoClient(MONGO_URI, event_listeners=[pool_stats], **CLIENT_SETTINGS)
+        _client_pid = os.getpid()
+    return _client[DB_NAME]
+
+
+# Indexes every query in the app relies on: (collection, keys, options)
+INDEXES = (
+    ('electric_bills', [('username', ASCENDING), ('billing_period', DESCENDING)], {"name": "username_billing_period"}),
+    # Duplicate bill detection: same PDF bytes, or the same account and billing period
+    ('electric_bills', [('username', ASCENDING), ('content_hashes', ASCENDING)],
+     {"name": "username_content_hash_unique", "unique": True,
+      "partialFilterExpression": {"content_hashes": {"$exists": True}}}),
+    ('electric_bills', [('username', ASCENDING), ('account_number', ASCENDING), ('billing_period', ASCENDING)],
+     {"name": "username_account_period_unique", "unique": True,
+      "partialFilterExpression": {"account_number": {"$exists": True}, "billing_period": {"$type": "date"}}}),
+    ('electric_monthly_charges', [('username', ASCENDING), ('period', ASCENDING)],
+     {"name": "username_period_unique", "unique": True}),
+    ('electric_monthly_charges', [('username', ASCENDING), ('updated_at', DESCENDING)],
+     {"name": "username_updated_at"}),
+    ('electric_consumption', [('username', ASCENDING), ('_id', DESCENDING)], {"name": "username_id"}),
+    ('user', [('username', ASCENDING)], {"name": "username_unique", "unique": True}),
+    ('user', [('email', ASCENDING)], {"name": "email_unique", "unique": True}),
+    ('ingest_jobs', [('created_at', ASCENDING)], {"name": "created_at_ttl", "expireAfterSeconds": JOB_TTL_SECONDS}),
+)
+
+
+# Function to create the indexes at startup (a no-op when they already exist)
+# Indexes named in required raise when they cannot be created; the others are only logged
+def ensure_indexes(db, required=()):
+    for collection, keys, options in INDEXES:
+        try:
+            db[collection].create_index(keys, **options)
+        except OperationFailure as e:
+            if options['name'] in required:
+                raise
+            # e.g. existing duplicate usernames block a unique index; keep serving
+            logger.warning("Could not create index %s on %s: %s", options['name'], collection, e)
+
+
+# Function to create the indexes on first use instead of at import time
+def ensure_indexes_once():
+    global _indexes_ready
+    if _indexes_ready:
+        return
+    with _indexes_lock:
+        if not _indexes_ready:
+            try:
+                ensure_indexes(get_db())
+            except PyMongoError as e:
+                # Mongo is unreachable; try again on the next request instead of failing this one
+                logger.warning("Could not create indexes: %s", e)
+                return
+            _indexes_ready = True
+
+
+# Function to check Mongo for /healthz: ping, per-collection query latency and pool usage
+# Returns (report, healthy); unhealthy means the load balancer should stop sending traffic
+def health():
+    report = {"status": "ok", "pool": pool_stats.snapshot(),
+              "max_pool_size": CLIENT_SETTINGS["maxPoolSize"], "collections": {}}
+    try:
+        db = get_db()
+        start = time.perf_counter()
+        db.command('ping')
+        report["ping_ms"] = round((time.perf_counter() - start) * 1000, 2)
+
+        for name in HEALTH_COLLECTIONS:
+            start = time.perf_counter()
+            db[name].find_one({}, {"_id": 1}, max_time_ms=HEALTH_TIMEOUT_MS)
+            report["collections"][name] = round((time.perf_counter() - start) * 1000, 2)
+    except PyMongoError as e:
+        report.update(status="unavailable", error=str(e))
+        return report, False
+
+    slowest = max([report["ping_ms"], *report["collections"].values()])
+    if slowest > HEALTH_SLOW_MS:
+        report["status"] = "degraded"
+    return report, report["status"] == "ok"
@@ -0,0 +1,56 @@
+import io
+
+from PyPDF2 import PdfReader
+
+import bill_parser
+import metrics
+import pdf_text_cache
+
+
+# Function to yield the text of each PDF page only when it is needed
+def iter_pdf_pages(reader):
+    for page in reader.pages:
+        yield page.extract_text()
+
+
+# Function to open a PDF given as a path, raw bytes or a file object
+def open_pdf(source):
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    return PdfReader(source)
+
+
+# Function to extract and parse a bill, stopping once every section is closed
+# source is a path, raw bytes or a file object; digest skips re-hashing an upload
+def extract_bill(source, digest=None):
+    if digest is None:
+        digest = pdf_text_cache.hash_pdf(source)
+    cached_text = pdf_text_cache.get_cached_text(digest)
+    if cached_text is not None:
+        metrics.inc('pdf_text_cache_total', result='hit')
+        with metrics.stage("parse"):
+            bill = bill_parser.parse_bill(cached_text)
+        bill.update(digest=digest, text=cached_text, pages_read=0, pages_skipped=0)
+        return bill
+
+    metrics.inc('pdf_text_cache_total', result='miss')
+    with metrics.stage("pdf_extract"):
+        reader = open_pdf(source)
+        total_pages = len(reader.pages)
+        scanner = bill_parser.SectionScanner()
+        pages_read = 0
+
+        for page_text in iter_pdf_pages(reader):
+            scanner.feed(page_text)
+            pages_read += 1
+            if scanner.complete():
+                break
+
+    # Only a fully read document is cached, since /upload shows the whole text
+    if pages_read == total_pages:
+        pdf_text_cache.store_cached_text(digest, scanner.text)
+
+    with metrics.stage("parse"):
+        bill = bill_parser.parser.build_record(scanner.sections(), scanner.text)
+    bill.update(digest=digest, text=scanner.text, pages_read=pages_read, pages_skipped=total_pages - pages_read)
+    return bill
@@ -0,0 +1,137 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import artifacts
+
+# Cache settings (the on-disk store is keyed by the SHA-256 of the PDF bytes)
+CACHE_FOLDER = os.path.join('cache', 'pdf_text')
+MEMORY_CACHE_SIZE = 64  # Number of extracted texts kept in-process
+DISK_CACHE_MAX_BYTES = 200 * 1024 * 1024  # Evict oldest entries past this size
+DISK_CACHE_LOW_WATER = 0.9  # Eviction trims down to this share of the limit, so it does not run on every store
+
+_memory_cache = OrderedDict()
+_lock = threading.Lock()
+# Running size of the disk cache as seen by this process; stores add to it and only a full
+# eviction pass (on overflow, or from the artifacts janitor) walks the folder and resets it
+_disk_bytes = 0
+
+
+# Function to hash a PDF file by content
+def hash_pdf_file(file_path):
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(64 * 1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+# Function to hash a PDF given as a path, raw bytes or a seekable file object
+def hash_pdf(source):
+    if isinstance(source, (bytes, bytearray)):
+        return hashlib.sha256(source).hexdigest()
+    if isinstance(source, str):
+        return hash_pdf_file(source)
+    sha256 = hashlib.sha256()
+    source.seek(0)
+    for chunk in iter(lambda: source.read(64 * 1024), b''):
+        sha256.update(chunk)
+    source.seek(0)
+    return sha256.hexdigest()
+
+
+def _disk_path(digest):
+    return os.path.join(CACHE_FOLDER, digest[:2], f"{digest}.txt")
+
+
+def _remember(digest, text):
+    with _lock:
+        _memory_cache[digest] = text
+        _memory_cache.move_to_end(digest)
+        while len(_memory_cache) > MEMORY_CACHE_SIZE:
+            _memory_cache.popitem(last=False)
+
+
+# Function to look up extracted text by content hash (memory first, then disk)
+def get_cached_text(digest):
+    with _lock:
+        if digest in _memory_cache:
+            _memory_cache.move_to_end(digest)
+            return _memory_cache[digest]
+
+    path = _disk_path(digest)
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            text = file.read()
+    except FileNotFoundError:
+        return None
+
+    # Touch the file so eviction treats it as recently used
+    os.utime(path)
+    _remember(digest, text)
+    return text
+
+
+# Function to store extracted text in both cache layers
+def store_cached_text(digest, text):
+    global _disk_bytes
+    _remember(digest, text)
+
+    path = _disk_path(digest)
+    artifacts.atomic_write_text(path, text)
+
+    with _lock:
+        _disk_bytes += os.path.getsize(path)
+        overflow = _disk_bytes > DISK_CACHE_MAX_BYTES
+    if overflow:
+        evict_disk_cache()
+
+
+# Function to keep the on-disk cache under DISK_CACHE_MAX_BYTES (walks the whole folder)
+# Also registered with the artifacts janitor, which corrects for other processes' stores
+def evict_disk_cache(max_bytes=None):
+    global _disk_bytes
+    if max_bytes is None:
+        max_bytes = DISK_CACHE_MAX_BYTES
+    entries = []
+    total_size = 0
+    for root, _, files in os.walk(CACHE_FOLDER):
+        for name in files:
+            if not name.endswith('.txt'):
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total_size += stat.st_size
+
+    if total_size > max_bytes:
+        # Remove least recently used entries first
+        target = max_bytes * DISK_CACHE_LOW_WATER
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+            if total_size <= target:
+                break
+
+    with _lock:
+        _disk_bytes = total_size
+
+
+# Function to return the text of a PDF, running extractor only on a cache miss
+# source is a path or an open file; pass digest when it is already known (e.g. hashed on upload)
+def cached_extract(source, extractor, digest=None):
+    if digest is None:
+        digest = hash_pdf(source)
+
+    text = get_cached_text(digest)
+    if text is None:
+        text = extractor(source)
+        store_cached_text(digest, text)
+    return text
@@ -1,27 +1,39 @@
-import re
 import os
 from flask import Flask, request, render_template, redirect, url_for
 from PyPDF2 import PdfReader
-from werkzeug.utils import secure_filename
 from urllib.parse import unquote
-import malaya
-import csv
-import pandas as pd 
+import logging
+import threading
+import pdf_text_cache
+import artifacts
+import bill_exports
+import bill_parser
+import pdf_stream
+import text_normalizer
+import uploads
+import metrics
+import app_log
 
 
 # Flask app setup
-app = Flask(__name__)
+_app = Flask(__name__)  # Handed out as `app` only once create_app() has set it up
+logger = logging.getLogger(__name__)
+_configured = False
+_configure_lock = threading.Lock()
+
+# Uploaded files are spooled in memory and hashed while they are received
+_app.request_class = uploads.UploadRequest
 UPLOAD_FOLDER = 'uploads'
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+_app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 OUTPUT_FOLDER = os.path.join('static', 'output')  # Save in static for easy serving
-app.config['OUTPUT_FOLDER'] = OUTPUT_FOLDER
+_app.config['OUTPUT_FOLDER'] = OUTPUT_FOLDER
+
+# "regex" (default) normalizes only the detailed charges section; "malaya" tokenizes the whole PDF
+TEXT_NORMALIZER = os.environ.get('TEXT_NORMALIZER', 'regex')
 
-# Ensure the upload and output folders exist
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
-# Function to extract text from the PDF
-def extract_text_from_pdf(file_path):
+# Function to read every page of the PDF with PyPDF2
+def read_pdf_text(file_path):
     reader = PdfReader(file_path)
     text = ""
     for page in reader.pages:
@@ -30,53 +42,32 @@ def extract_text_from_pdf(file_path):
 
  # Function to preprocess text using Malaya and normalize whitespace
 def preprocess_text(text):
-     # Tokenize using Malaya's tokenizer
-     tokenizer = malaya.tokenizer.Tokenizer()
-     return tokenizer.tokenize(text)
+     # Shared tokenizer, loaded on first use (regex fallback when malaya is missing)
+     return text_normalizer.tokenize(text)
 
 
 # Function to extract the Monthly Charges block
 def extract_monthly_charges_block(text):
-    start_marker = r"Caj Elektrik Anda Bagi Tempoh 6 Bulan"
-    end_marker = r"\d+\s?Purata Caj Bulanan"
-    pattern = f"{start_marker}.*?{end_marker}"
-
-    match = re.search(pattern, text, re.DOTALL)
-    if match:
-        return match.group()
+    section = bill_parser.section_text(text, "monthly_charges")
+    if section is not None:
+        return section
+    metrics.inc('bill_extraction_failures_total', reason='no_charges_section')
     return "No matching charges section found."
 
 
 # Function to extract month names and charges
 def extract_months_and_charges(charges_text):
-    months = []
-    charges = []
-    pattern = r"([A-Z]{3}-\d{2})\s*(?:\(BS\))?\s*([RM0-9,\.]+)"
-    matches = re.findall(pattern, charges_text)
-
-    for match in matches:
-        month, charge = match
-        months.append(month)
-        charges.append(charge)
-
-
-    return months, charges
+    return bill_parser.parser.parse_monthly_charges(charges_text)
 
 
 
 # Function to extract the Detailed Charges block and save it to a .txt file
-def extract_detailed_charges_block(text, filename="detailed_charges_block.txt"):
-    start_marker = r"Keterangan Tanpa ST Dengan ST Jumlah"
-    end_marker = r"Caj Semasa RM \d+\.\d{2}"
-    pattern = f"{start_marker}.*?{end_marker}"
-
-    match = re.search(pattern, text, re.DOTALL)
-    if match:
-        detailed_charges_text = match.group()
-
-        # Save the extracted detailed charges block to a .txt file
-        with open(filename, "w") as file:
-            file.write(detailed_charges_text)
+def extract_detailed_charges_block(text, filename=None):
+    detailed_charges_text = bill_parser.section_text(text, "detailed_charges")
+    if detailed_charges_text is not None:
+        # Save the extracted detailed charges block to a .txt file when asked to
+        if filename:
+            artifacts.atomic_write_text(filename, detailed_charges_text)
 
         return detailed_charges_text
     else:
@@ -87,57 +78,7 @@ def extract_detailed_charges_block(text, filename="detailed_charges_block.txt"):
 
 
 def extract_detailed_charges_data(detailed_charges_text):
-    total_usage_no_st = ""
-    total_usage_st = ""
-    icpt_no_st = ""
-    icpt_st = ""
-    kwtbb = ""
-    current_charge = ""
-
-    # Update regex to handle negative numbers with spaces
-    number_pattern = r"-?\s*[\d.,]+"  # Matches positive or negative numbers with optional spaces after '-'
-
-    # Extract Total Usage (No ST) and (ST)
-    total_usage_match = re.search(
-        fr"Jumlah Penggunaan Anda\s*\(.*?\)\s*RM\s*({number_pattern})\s*({number_pattern})\s*({number_pattern})",
-        detailed_charges_text,
-    )
-    if total_usage_match:
-        total_usage_no_st = total_usage_match.group(1).replace(" ", "")  # Remove extra spaces
-        total_usage_st = total_usage_match.group(2).replace(" ", "")
-
-    # Extract ICPT (No ST) and (ST)
-    icpt_match = re.search(
-        fr"ICPT\s*\(.*?\)\s*RM\s*({number_pattern})\s*({number_pattern})\s*({number_pattern})",
-        detailed_charges_text,
-    )
-    if icpt_match:
-        icpt_no_st = icpt_match.group(1).replace(" ", "")
-        icpt_st = icpt_match.group(2).replace(" ", "")
-
-    # Extract KWTBB
-    kwtbb_match = re.search(
-        fr"Kumpulan Wang Tenaga Boleh Baharu\s*\(.*?\)\s*RM\s*({number_pattern})",
-        detailed_charges_text,
-    )
-    if kwtbb_match:
-        kwtbb = kwtbb_match.group(1).replace(" ", "")
-
-    # Extract Current Charge
-    current_charge_match = re.search(
-        fr"Caj Semasa\s*RM\s*({number_pattern})", detailed_charges_text
-    )
-    if current_charge_match:
-        current_charge = current_charge_match.group(1).replace(" ", "")
-
-    return {
-        "Total Usage (No ST)": total_usage_no_st,
-        "Total Usage (ST)": total_usage_st,
-        "ICPT (No ST)": icpt_no_st,
-        "ICPT (ST)": icpt_st,
-        "KWTBB (1.6%)": kwtbb,
-        "Current Charge": current_charge,
-    }
+    return bill_parser.parser.parse_detailed_charges(detailed_charges_text)
 
 
 
@@ -179,102 +120,35 @@ def parse_text_to_csv(txt_filename="detailed_charges_block.txt", csv_filename="d
                 f"RM {extracted_data['Current Charge']}",
             ])
 
-        print(f"Data has been successfully written to {csv_filename} (headers as columns).")
+        logger.debug("Detailed charges written to %s", csv_filename)
 
     except FileNotFoundError:
-        print(f"Error: The file {txt_filename} does not exist.")
-    except Exception as e:
-        print(f"An error occurred: {e}")
+        logger.warning("The file %s does not exist", txt_filename)
+    except Exception:
+        logger.exception("Could not write %s", csv_filename)
 
 
 # Function to extract the meter reading block from the text
 def extract_meter_reading_block(text):
-    start_marker = r"Maklumat Meter"
-    end_marker = r"\s*PERBANKAN INTERNET"
-    
-    # Update the pattern to capture everything between the markers, including new lines and spaces
-    pattern = f"{start_marker}(.*?){end_marker}"
-    
-    # Perform the search to find the block between the markers
-    match = re.search(pattern, text, re.DOTALL)
-    
+    meter_reading_text = bill_parser.section_text(text, "meter_reading")
+
     # If no match is found, return a message indicating no matching block
-    if not match:
+    if meter_reading_text is None:
         return "no matching charges section found."
-    
-    # Extract the meter reading block
-    meter_reading_text = match.group(1).strip()
 
-    # Print the extracted meter reading text
-    print("###", meter_reading_text, "###")
+    logger.debug("Meter reading block found", extra={"chars": len(meter_reading_text)})
 
     # Return the isolated meter reading text
     return meter_reading_text
 
 
-# Function to save meter readings into CSV
-def save_meter_reading_to_csv(meter_reading_text, output_file_path):
-
-    meter_reading_text = re.sub(r"(kWh|kW|kVARh)Saluran", r"\1", meter_reading_text)
-
-    # Regular expression to capture the data fields in each row
-    pattern = r"(M\s+\S+)\s+(\d{1,3}(?:,\d{3})*)\s+(\d{1,3}(?:,\d{3})*)\s+(\d+)\s+(\w+)"
-    
-    # List to hold the parsed data
-    rows = []
-    
-    # Find all matches based on the pattern
-    for match in re.finditer(pattern, meter_reading_text):
-        meter_number = match.group(1).strip()
-        prev_reading = int(match.group(2).replace(",", ""))
-        curr_reading = int(match.group(3).replace(",", ""))
-        usage = int(match.group(4))
-        unit = match.group(5).strip()
-        
-        # Append the extracted data to rows
-        rows.append([meter_number, prev_reading, curr_reading, usage, unit])
-    
-    # Write the rows to a CSV file
-    with open(output_file_path, mode='w', newline='') as file:
-        writer = csv.writer(file)
-        # Writing the header
-        writer.writerow(["Meter Number", "Previous Meter Reading", "Current Meter Reading", "Usage", "Unit"])
-        # Writing the data rows
-        writer.writerows(rows)
-    
-    print(f"Data saved to {output_file_path}")
-
-
-
-def combine_csv_files(monthly_csv, detailed_csv, meter_reading_csv, output_csv):
-    try:
-        # Read the three CSV files into dataframes
-        monthly_df = pd.read_csv(monthly_csv)
-        detailed_df = pd.read_csv(detailed_csv)
-        meter_reading_df = pd.read_csv(meter_reading_csv)
-
-        # Merge the dataframes side by side (using pd.concat)
-        combined_df = pd.concat([monthly_df, detailed_df, meter_reading_df], axis=1)
-
-        # Save the combined dataframe to a new CSV file
-        combined_df.to_csv(output_csv, index=False)
-
-        print(f"Combined data saved to {output_csv}")
-        return output_csv  # Return the path to the combined CSV
-    except Exception as e:
-        print(f"Error during combining files: {e}")
-        return None
-    
-
-
-
 # Route for the home page
-@app.route('/')
+@_app.route('/')
 def index():
     return render_template('index.html')
 
 # Route to handle PDF file upload and display all extracted text
-@app.route('/upload', methods=['POST'])
+@_app.route('/upload', methods=['POST'])
 def upload_file():
     if 'file' not in request.files:
         return redirect(request.url)
@@ -284,64 +158,57 @@ def upload_file():
         return redirect(request.url)
 
     if file:
-        filename = secure_filename(file.filename)
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(file_path)
+        # /extract needs the file again, so it goes to the content-addressed store
+        # (re-uploading the same PDF reuses the stored copy; names can no longer clash)
+        upload = uploads.receive(file)
+        upload.persist()
 
-        pdf_text = extract_text_from_pdf(file_path)
-        return render_template('view_text.html', pdf_text=pdf_text, file_path=filename)
+        pdf_text = pdf_text_cache.cached_extract(upload.open(), read_pdf_text, upload.digest)
+        return render_template('view_text.html', pdf_text=pdf_text, file_path=upload.digest)
 
 
 
 
 
 
-@app.route('/extract/<path:filename>')
+@_app.route('/extract/<path:filename>')
 def extract_desired_text(filename):
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    file_path = unquote(file_path)
+    # filename is the upload's SHA-256 digest in the content-addressed store
+    digest = unquote(filename)
+    file_path = uploads.stored_upload(digest)
 
-    if not os.path.exists(file_path):
-        return f"File not found: {file_path}", 404
+    if file_path is None:
+        return f"File not found: {digest}", 404
 
-    pdf_text = extract_text_from_pdf(file_path)
+    # Read PDF pages only until every bill section is found
+    bill = pdf_stream.extract_bill(file_path, digest)
+    pdf_text = bill["text"]
+    logger.debug("Read bill PDF", extra={"pages_read": bill["pages_read"], "pages_skipped": bill["pages_skipped"]})
 
-    # **Monthly Charges Extraction**
-    monthly_charges_text = extract_monthly_charges_block(pdf_text)
-    months, charges = extract_months_and_charges(monthly_charges_text)
+    # Each upload gets its own folder, so concurrent requests never share output files
+    output_dir = artifacts.artifact_dir(bill["digest"])
 
-    monthly_output_file_path = os.path.join(app.config['OUTPUT_FOLDER'], 'monthly_charges.csv')
-    with open(monthly_output_file_path, 'w', newline='') as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(['Month', 'Charge'])
-        for month, charge in zip(months, charges):
-            writer.writerow([month, charge])
+    # **Monthly Charges Extraction**
+    months, charges = bill["months"], bill["charges"]
 
     # **Detailed Charges Extraction**
-    preprocessed_text = preprocess_text(pdf_text)
-    detailed_charges_text = extract_detailed_charges_block(" ".join(preprocessed_text))
-
-    extracted_detailed_charges_data = extract_detailed_charges_data(detailed_charges_text)
-
-    detailed_output_file_path = os.path.join(app.config['OUTPUT_FOLDER'], 'detailed_charges_data.csv')
-    with open(detailed_output_file_path, 'w', newline='') as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(extracted_detailed_charges_data.keys())
-        writer.writerow(extracted_detailed_charges_data.values())
-
-    # **Meter Reading Extraction**
-    meter_reading_text = extract_meter_reading_block(pdf_text)
-    meter_reading_output_file_path = os.path.join(app.config['OUTPUT_FOLDER'], 'meter_reading_data.csv')
-    save_meter_reading_to_csv(meter_reading_text, meter_reading_output_file_path)
-
-    # **Combine the CSVs**
-    combined_output_file_path = os.path.join(app.config['OUTPUT_FOLDER'], 'combined_output.csv')
-    combine_csv_files(
-        monthly_csv=monthly_output_file_path,
-        detailed_csv=detailed_output_file_path,
-        meter_reading_csv=meter_reading_output_file_path,
-        output_csv=combined_output_file_path
-    )
+    with metrics.stage("detailed_charges"):
+        if TEXT_NORMALIZER == 'malaya':
+            normalized_text = " ".join(preprocess_text(pdf_text))
+        else:
+            normalized_text = text_normalizer.normalize_section(pdf_text, "detailed_charges")
+        detailed_charges_text = extract_detailed_charges_block(
+            normalized_text, filename=os.path.join(output_dir, "detailed_charges_block.txt"))
+
+        extracted_detailed_charges_data = extract_detailed_charges_data(detailed_charges_text)
+    bill["detailed_charges"] = extracted_detailed_charges_data
+
+    # **Write the monthly, detailed, meter reading and combined CSVs**
+    output_paths = bill_exports.write_exports(bill_parser.bill_document(bill), output_dir)
+    monthly_output_file_path = output_paths["monthly_charges"]
+    detailed_output_file_path = output_paths["detailed_charges_data"]
+    meter_reading_output_file_path = output_paths["meter_reading_data"]
+    combined_output_file_path = output_paths["combined_output"]
 
     # Render the results with links to download the files
     return render_template(
@@ -361,6 +228,45 @@ def extract_desired_text(filename):
 
 
 
+# Function to finish setting up the app (startup side effects live here, not at import)
+# Safe to call more than once: the setup runs on the first call and every call returns the same app
+def create_app():
+    global _configured
+    with _configure_lock:
+        if not _configured:
+            _configure()
+            _configured = True
+    return _app
+
+
+def _configure():
+    # Ensure the upload and output folders exist
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+
+    # Request timings and pipeline counters at /metrics
+    metrics.init_app(_app)
+
+    # JSON logs written by a background thread, one record per request with its stage timings
+    app_log.init_app(_app)
+
+    # Remove old per-upload output folders and stored uploads, and trim the PDF text cache, in the background
+    artifacts.add_cleanup(uploads.cleanup_expired)
+    artifacts.add_cleanup(pdf_text_cache.evict_disk_cache)
+    artifacts.start_janitor()
+
+    # Load malaya in the background so startup and the first /extract do not wait for it
+    if TEXT_NORMALIZER == 'malaya':
+        text_normalizer.warm_up()
+
+
+# `app` (gunicorn app:app, flask run) is only handed out once create_app() has set it up
+def __getattr__(name):
+    if name == 'app':
+        return create_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 # Run the Flask app
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app().run(debug=True)
@@ -0,0 +1,95 @@
+import logging
+import re
+import threading
+
+import bill_parser
+
+# Text normalization for the extraction pipeline.
+# normalize_section() is the fast default. The malaya tokenizer is optional: it is imported
+# on first use (or by warm_up()), and when it is not installed a regex tokenizer with the
+# same "tokens joined by spaces" output is used instead.
+_tokenizer = None
+_loaded = False
+_lock = threading.Lock()
+logger = logging.getLogger(__name__)
+
+# Numbers (with thousands separators / decimals), words, then any single symbol
+TOKEN_RE = re.compile(r"\d+(?:[.,]\d+)*|[^\W\d_]+|\w+|[^\w\s]")
+
+
+# PDF spacing artifacts, fixed in a single pass:
+# whitespace runs, "- 3.91" negatives, units glued to the next word ("kWhSaluran"),
+# words glued to "RM" ("SemasaRM") and letters glued to digits ("RM123.45", "100kWh")
+SPACING_RE = re.compile(
+    r"(?P<space>\s+)"
+    r"|(?P<negative>-\s+(?=\d))"
+    r"|(?P<unit>(?:kVARh|kWh|kW)(?=[A-Z][a-z]))"
+    r"|(?P<split>(?<=[a-z])(?=RM)|(?<=[A-Za-z])(?=\d)|(?<=\d)(?=[A-Za-z]))"
+)
+SPACING_REPLACEMENTS = {"space": " ", "negative": "-", "split": " "}
+
+
+def _fix_spacing(match):
+    if match.lastgroup == "unit":
+        return match.group() + " "
+    return SPACING_REPLACEMENTS[match.lastgroup]
+
+
+# Function to normalize PDF spacing artifacts without tokenizing
+def normalize_spacing(text):
+    return SPACING_RE.sub(_fix_spacing, text or "").strip()
+
+
+# Function to normalize only one bill section (falls back to the whole text when it is not found)
+def normalize_section(text, name):
+    span = bill_parser.loose_section_span(text or "", name)
+    if span is not None:
+        text = text[span[0]:span[1]]
+    return normalize_spacing(text)
+
+
+# Function to get the shared malaya Tokenizer, or None when malaya is unavailable
+def get_tokenizer():
+    global _tokenizer, _loaded
+    if _loaded:
+        return _tokenizer
+    with _lock:
+        if not _loaded:
+            try:
+                import malaya
+                _tokenizer = malaya.tokenizer.Tokenizer()
+            except ImportError:
+                _tokenizer = None
+                logger.warning("malaya is not installed, using the regex tokenizer")
+            except Exception:
+                # A broken install fails the same way on every import; load it once, not per call
+                _tokenizer = None
+                logger.exception("Could not load malaya, using the regex tokenizer")
+            _loaded = True
+    return _tokenizer
+
+
+# Function to split text into tokens without malaya
+# Spacing is fixed first, so glued words like "SemasaRM" become two tokens as they do with malaya
+def regex_tokenize(text):
+    return TOKEN_RE.findall(normalize_spacing(text))
+
+
+# Function to tokenize text with malaya when available, else with the regex tokenizer
+def tokenize(text):
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        return regex_tokenize(text)
+    return tokenizer.tokenize(text)
+
+
+# Function to normalize spacing by re-joining the tokens with single spaces
+def normalize(text):
+    return " ".join(tokenize(text))
+
+
+# Function to load malaya in a background thread so the first request does not pay for it
+def warm_up():
+    thread = threading.Thread(target=tokenize, args=("Caj Semasa RM 0.00",), name="malaya-warm-up", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,128 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+
+from flask import Request
+
+import artifacts
+
+# Upload settings
+SPOOL_MAX_MEMORY = 8 * 1024 * 1024  # Larger uploads roll over to an anonymous temp file
+CHUNK_SIZE = 64 * 1024
+STORE_FOLDER = 'uploads'  # Content-addressed store: uploads/<sha256[:2]>/<sha256>.pdf
+PERSIST_UPLOADS = os.environ.get('PERSIST_UPLOADS', '0') == '1'
+UPLOAD_TTL_SECONDS = int(os.environ.get('UPLOAD_TTL_SECONDS', str(7 * 24 * 60 * 60)))  # Unused stored PDFs expire
+
+
+class HashingSpooledFile:
+    # Spooled buffer that hashes bytes as they are written, so no second pass is needed
+
+    def __init__(self, max_size=SPOOL_MAX_MEMORY):
+        self.file = tempfile.SpooledTemporaryFile(max_size=max_size)
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.size += len(data)
+        return self.file.write(data)
+
+    def hexdigest(self):
+        return self.sha256.hexdigest()
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+    def __iter__(self):
+        return iter(self.file)
+
+
+class UploadRequest(Request):
+    # Multipart file parts are written straight into a HashingSpooledFile while received
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingSpooledFile()
+
+
+class Upload:
+    # One received file: its hashed buffer plus, once persisted, its path in the store
+
+    def __init__(self, filename, stream, digest, size):
+        self.filename = filename
+        self.stream = stream
+        self.digest = digest
+        self.size = size
+        self.path = None
+
+    # Function to rewind and return the buffer (PdfReader reads from it directly)
+    def open(self):
+        self.stream.seek(0)
+        return self.stream
+
+    def data(self):
+        return self.open().read()
+
+    # Function to get what a pool worker should read: the stored path, else the raw bytes
+    def source(self):
+        return self.path if self.path is not None else self.data()
+
+    # Function to keep the upload in the content-addressed store (identical files are stored once)
+    def persist(self):
+        path = store_path(self.digest)
+        if os.path.exists(path):
+            os.utime(path)
+        else:
+            with artifacts.atomic_open(path, 'wb') as target:
+                shutil.copyfileobj(self.open(), target, CHUNK_SIZE)
+        self.path = path
+        return path
+
+
+# Function to take a werkzeug FileStorage as an Upload, hashing it only if it was not hashed on receipt
+def receive(file):
+    stream = file.stream
+    if not isinstance(stream, HashingSpooledFile):
+        spooled = HashingSpooledFile()
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+            spooled.write(chunk)
+        stream = spooled
+    upload = Upload(file.filename, stream, stream.hexdigest(), stream.size)
+    if PERSIST_UPLOADS:
+        upload.persist()
+    return upload
+
+
+# Function to get where a digest lives in the content-addressed store
+def store_path(digest):
+    return os.path.join(STORE_FOLDER, digest[:2], f"{digest}.pdf")
+
+
+# Function to find a stored upload by digest, or None (digests are hex, so no path tricks)
+def stored_upload(digest):
+    if len(digest) != 64 or any(c not in '0123456789abcdef' for c in digest):
+        return None
+    path = store_path(digest)
+    return path if os.path.exists(path) else None
+
+
+# Function to remove stored uploads not used within the TTL (run by the artifacts janitor)
+def cleanup_expired(ttl_seconds=UPLOAD_TTL_SECONDS):
+    if not os.path.isdir(STORE_FOLDER):
+        return 0
+
+    cutoff = time.time() - ttl_seconds
+    removed = 0
+    for root, _, files in os.walk(STORE_FOLDER):
+        for name in files:
+            if not name.endswith('.pdf'):
+                continue
+            path = os.path.join(root, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+    return removed